@@ -0,0 +1,71 @@
+"""
+Peak RSS per book: runs benchmarks.bench_pipeline offline at increasing numbers of books in flight, each in a fresh
+process, and fits peak RSS = baseline + per book x books in flight. The per-book figure is what JOB_MEMORY_ESTIMATE
+should be at least, and with it the report shows how many books a machine can run at once within MEMORY_BUDGET.
+The accounted peak (the buffers that admission control tracks) is shown next to it, their ratio is JOB_MEMORY_HEADROOM.
+
+Run from backend/: python -m benchmarks.bench_memory [--levels 1,2,4] [--memory BYTES] [--latency-scale S]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MB = 1024 * 1024
+
+
+def measure(concurrency: int, books: int, latency_scale: float) -> dict:
+    result = subprocess.run(
+        [sys.executable, "-m", "benchmarks.bench_pipeline", "--books", str(books), "--concurrency", str(concurrency),
+         "--latency-scale", str(latency_scale), "--json"],
+        cwd=BACKEND_DIR, capture_output=True, text=True, check=True,
+    )
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+def fit(points: list) -> tuple:
+    # least squares line through (books in flight, peak RSS)
+    n = len(points)
+    mean_x = sum(x for x, _ in points) / n
+    mean_y = sum(y for _, y in points) / n
+    spread = sum((x - mean_x) ** 2 for x, _ in points)
+    slope = sum((x - mean_x) * (y - mean_y) for x, y in points) / spread if spread else mean_y / mean_x
+    return mean_y - slope * mean_x, slope
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--levels", default="1,2,4", help="comma separated numbers of books in flight")
+    parser.add_argument("--rounds", type=int, default=2, help="books per level, as a multiple of the level")
+    parser.add_argument("--latency-scale", type=float, default=0.05, help="multiplier on the simulated model latencies")
+    parser.add_argument("--memory", type=int, default=1024 * MB, help="machine memory to plan for, in bytes (default 1 GB)")
+    parser.add_argument("--budget-fraction", type=float, default=float(os.environ.get("MEMORY_BUDGET_FRACTION", "0.5")),
+                        help="share of --memory given to jobs, as MEMORY_BUDGET_FRACTION")
+    args = parser.parse_args()
+
+    # accounted is the largest accounted peak of one book at that level
+    print(f"{'in flight':>10}{'books':>7}{'baseline':>10}{'peak RSS':>10}{'per book':>10}{'accounted':>11}")
+    points = []
+    accounted = []
+    for level in (int(level) for level in args.levels.split(",")):
+        run = measure(level, level * args.rounds, args.latency_scale)
+        per_book = (run["peak_rss"] - run["baseline_rss"]) / run["in_flight"]
+        points.append((run["in_flight"], run["peak_rss"] - run["baseline_rss"]))
+        if run["accounted_peak_mean"]:
+            accounted.append(run["accounted_peak_mean"])
+        print(f"{run['in_flight']:>10}{run['books']:>7}{run['baseline_rss'] / MB:>8.0f}MB{run['peak_rss'] / MB:>8.0f}MB"
+              f"{per_book / MB:>8.1f}MB{(run['accounted_peak_max'] or 0) / MB:>9.1f}MB")
+
+    fixed, per_book = fit(points)
+    print(f"\npeak RSS ~ baseline + {fixed / MB:.0f} MB + {per_book / MB:.1f} MB per book in flight")
+    if accounted:
+        print(f"RSS per book / mean accounted peak = {per_book / (sum(accounted) / len(accounted)):.1f} (JOB_MEMORY_HEADROOM)")
+    budget = args.memory * args.budget_fraction
+    print(f"a {args.memory / MB:.0f} MB machine with MEMORY_BUDGET {budget / MB:.0f} MB runs "
+          f"{int(budget // max(per_book, 1))} books at once at {per_book / MB:.0f} MB each")
+
+
+if __name__ == "__main__":
+    main()
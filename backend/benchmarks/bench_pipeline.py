@@ -0,0 +1,185 @@
+"""
+End-to-end storybook generation benchmark that runs entirely offline.
+Models and Supabase are replaced by the fake providers (MODEL_PROVIDER=fake, SUPABASE_PROVIDER=fake), which answer
+from the fixtures in res/ after a simulated delay; everything else (API, job queue, pipeline, PDF, storage) is the real code.
+Books are requested through POST /generate with up to --concurrency in flight, or through POST /generate-batch in groups
+of --batch books, and the report shows per-stage wall time, book latency p50/p95, throughput, model calls per book and peak RSS.
+
+Run from backend/: python -m benchmarks.bench_pipeline [--books N] [--concurrency C] [--batch B] [--latency-scale S]
+"""
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+STAGES = ("queued", "storyboard", "characters", "scenes", "pdf + upload", "total")
+
+
+def configure(args, work_dir: str):
+    # must happen before the app modules are imported, they read their settings at import time
+    os.environ.update({
+        "MODEL_PROVIDER": "fake",
+        "SUPABASE_PROVIDER": "fake",
+        "SUPABASE_URL": "http://supabase.offline",
+        "SUPABASE_SECRET_KEY": "offline",
+        "SUPABASE_JWT_SECRET": "offline-secret",
+        "PIPELINE_MODE": "orchestrator",
+        "FAKE_LATENCY_SCALE": str(args.latency_scale),
+        "FAKE_FAILURE_RATE": str(args.failure_rate),
+        "JOBS_DIR": os.path.join(work_dir, "jobs"),
+        "RUNS_DIR": os.path.join(work_dir, "runs"),
+        "CHARACTER_CACHE_DIR": os.path.join(work_dir, "characters"),
+        "JOB_WORKERS": str(args.concurrency),
+        "JOB_POLL_INTERVAL": "0.05",
+        "LOCAL_QUOTA_GENERATIONS": str(args.books),
+        "QUOTA_BACKEND": "local",
+        "RETRY_BACKOFF_BASE": str(args.latency_scale),
+        # 0 measures what books take unconstrained; set it to see admission control queue them
+        "MEMORY_BUDGET": str(args.memory_budget),
+    })
+    if not args.warm_cache:
+        os.environ["CHARACTER_CACHE_MAX_BYTES"] = "0"
+    if not args.rate_limits:
+        for prefix in ("OPENAI", "OPENAI_IMAGE", "GOOGLE"):
+            os.environ[f"{prefix}_RATE"] = "0"
+
+
+def percentile(values: list, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[max(int(len(ordered) * fraction + 0.5) - 1, 0)]
+
+
+def stage_times(job: dict, events: list) -> dict:
+    at = {}
+    for event in events:
+        # the last event of each kind marks the end of that stage
+        at[event["event"]] = event["created_at"]
+    started = at["running"]
+    finished = job["updated_at"]  # set when the job is marked done, just before its "done" event
+    return {
+        "queued": started - job["created_at"],
+        "storyboard": at["storyboard"] - started,
+        "characters": at["character"] - at["storyboard"],
+        "scenes": at["page"] - at["storyboard"],
+        "pdf + upload": finished - at["page"],
+        "total": finished - job["created_at"],
+        "interval": (started, finished),
+    }
+
+
+def max_in_flight(intervals: list) -> int:
+    edges = sorted([(start, 1) for start, _ in intervals] + [(end, -1) for _, end in intervals])
+    running = peak = 0
+    for _, change in edges:
+        running += change
+        peak = max(peak, running)
+    return peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--books", type=int, default=8, help="number of books to generate")
+    parser.add_argument("--concurrency", type=int, default=4, help="books in flight at once (also the job worker count)")
+    parser.add_argument("--latency-scale", type=float, default=0.05,
+                        help="multiplier on the simulated model latencies (1.0 is roughly production)")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="share of model calls that come back empty")
+    parser.add_argument("--warm-cache", action="store_true", help="keep the character cache between books")
+    parser.add_argument("--rate-limits", action="store_true", help="apply the configured per-provider request rates")
+    parser.add_argument("--batch", type=int, default=1,
+                        help="books per POST /generate-batch request (1 sends every book through POST /generate)")
+    parser.add_argument("--memory-budget", type=int, default=0,
+                        help="MEMORY_BUDGET for job admission in bytes (0 admits every book)")
+    parser.add_argument("--json", action="store_true", help="print the summary as one JSON line at the end")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="storybooker_bench_")
+    configure(args, work_dir)
+
+    from src.routes.app import create_app
+    from src.services.jobs import JobQueue, DONE, FAILED
+    from src.services import memory, telemetry
+    import src.services.agent  # noqa: F401  the generation stack belongs to the baseline, not to the first book
+
+    app = create_app()
+    client = app.test_client()
+    client.post("/user/signup", json={"email": "bench@example.com", "username": "bench", "password": "bench"})
+    token = client.post("/user/login", json={"email": "bench@example.com", "password": "bench"}).json["session"]["access_token"]
+    headers = {"Authorization": "Bearer " + token}
+    events = JobQueue(None, jobs_dir=os.environ["JOBS_DIR"])  # same database, no workers
+    baseline_rss = memory.rss_bytes()
+
+    results = []
+    failures = []
+    lock = threading.Lock()
+
+    def book(index: int) -> dict:
+        return {"title": f"Benchmark book {index}", "prompt": f"Benchmark story number {index}"}
+
+    def wait(job_id: str):
+        while True:
+            job = events.get(job_id)
+            if job["status"] in (DONE, FAILED):
+                break
+            time.sleep(0.05)
+        with lock:
+            if job["status"] == DONE:
+                results.append(stage_times(job, events.events(job_id)))
+            else:
+                failures.append(job["error"])
+
+    def generate_books(first: int):
+        client = app.test_client()
+        if args.batch == 1:
+            job_ids = [client.post("/generate", headers=headers, json=book(first)).json["job_id"]]
+        else:
+            books = [book(index) for index in range(first, min(first + args.batch, args.books))]
+            job_ids = client.post("/generate-batch", headers=headers, json={"books": books}).json["job_ids"]
+        for job_id in job_ids:
+            wait(job_id)
+
+    print(f"{args.books} books, {args.concurrency} concurrent, latency scale {args.latency_scale}, "
+          f"failure rate {args.failure_rate}, character cache {'warm' if args.warm_cache else 'off'}, "
+          f"rate limits {'on' if args.rate_limits else 'off'}, {args.batch} books per request")
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        list(executor.map(generate_books, range(0, args.books, args.batch)))
+    elapsed = time.perf_counter() - start
+
+    print(f"{'stage':<14}{'mean':>10}{'p50':>10}{'p95':>10}   (seconds, {len(results)} books)")
+    for stage in STAGES:
+        values = [result[stage] for result in results]
+        if values:
+            print(f"{stage:<14}{sum(values) / len(values):>10.2f}{percentile(values, 0.5):>10.2f}{percentile(values, 0.95):>10.2f}")
+    print(f"throughput    {len(results) / elapsed * 60:.1f} books/min ({elapsed:.1f} s wall)")
+    calls = {}
+    for (stage, _, _), count in telemetry.stage_seconds.counts().items():
+        if stage in ("storyboard", "character", "scene"):
+            calls[stage] = calls.get(stage, 0) + count
+    print("model calls   " + ", ".join(f"{stage} {count / max(len(results), 1):.2f}" for stage, count in sorted(calls.items()))
+          + " per book (character calls include cache hits)")
+    # books in flight at once are bounded by the job workers and by admission control, when a budget is set
+    peak_rss = memory.peak_rss_bytes()
+    in_flight = max(max_in_flight([result["interval"] for result in results]), 1)
+    peaks = events.peak_bytes()
+    estimate = events.memory_estimate()
+    print(f"peak RSS      {peak_rss / memory.MB:.0f} MB, {baseline_rss / memory.MB:.0f} MB before the first book, "
+          f"{(peak_rss - baseline_rss) / in_flight / memory.MB:.1f} MB per book in flight ({in_flight})")
+    if peaks:
+        print(f"accounted     {sum(peaks) / len(peaks) / memory.MB:.1f} MB mean, {max(peaks) / memory.MB:.1f} MB max peak per book; "
+              f"admission estimate {estimate / memory.MB:.0f} MB")
+    if failures:
+        print(f"{len(failures)} failed: {failures[:3]}")
+    if args.json:
+        print(json.dumps({
+            "books": len(results), "failed": len(failures), "in_flight": in_flight, "seconds": elapsed,
+            "baseline_rss": baseline_rss, "peak_rss": peak_rss,
+            "accounted_peak_mean": sum(peaks) / len(peaks) if peaks else None,
+            "accounted_peak_max": max(peaks) if peaks else None, "estimate": estimate,
+        }))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Cold start of the API and the MCP server: import time per module (python -X importtime), time to a ready app,
+the first answer from an authenticated endpoint, and which heavy generation dependencies were loaded along the way.
+Every measurement runs in a fresh interpreter; byte-compiled caches are warm, as on a deployed machine.
+
+Run from backend/: python -m benchmarks.bench_startup [--top N] [--repeat N]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ("strands", "mcp", "cv2", "numpy", "PIL", "openai", "google.genai")
+
+API_STARTUP = """
+import json, sys, time
+start = time.perf_counter()
+import src.server
+ready = time.perf_counter()
+# no token: answered by the auth check alone, without a network round trip
+response = src.server.gunicorn_app.test_client().get("/get-history")
+answered = time.perf_counter()
+print(json.dumps({
+    "ready": ready - start,
+    "first_request": answered - ready,
+    "status": response.status_code,
+    "heavy": [name for name in HEAVY if name in sys.modules],
+}))
+"""
+
+MCP_STARTUP = """
+import json, sys, time
+start = time.perf_counter()
+from src.services import mcpserver
+imported = time.perf_counter()
+mcpserver.create_server()
+ready = time.perf_counter()
+print(json.dumps({"import": imported - start, "ready": ready - start}))
+"""
+
+
+def environment() -> dict:
+    # the real Supabase client is created (it is part of startup) but never called
+    env = dict(os.environ)
+    env.setdefault("SUPABASE_URL", "http://supabase.offline")
+    env.setdefault("SUPABASE_SECRET_KEY", "offline")
+    return env
+
+
+def python(code: str, *flags) -> subprocess.CompletedProcess:
+    return subprocess.run([sys.executable, *flags, "-c", code], cwd=BACKEND_DIR, env=environment(),
+                          capture_output=True, text=True, check=True)
+
+
+def import_times(module: str) -> list:
+    """
+    Returns (cumulative seconds, self seconds, module) for every module imported by `import module`.
+    """
+    result = python(f"import {module}", "-X", "importtime")
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        times.append((int(cumulative_us) / 1e6, int(self_us) / 1e6, name.strip()))
+    return times
+
+
+def report_imports(module: str, top: int):
+    times = import_times(module)
+    total = max(cumulative for cumulative, _, name in times if name == module)
+    print(f"\nimport {module}: {total * 1000:.0f} ms, {len(times)} modules")
+    print(f"{'cumulative':>12}{'self':>10}  module")
+    for cumulative, self_time, name in sorted(times, reverse=True)[:top]:
+        print(f"{cumulative * 1000:>10.1f}ms{self_time * 1000:>8.1f}ms  {name}")
+
+    packages = {}
+    for _, self_time, name in times:
+        package = name.lstrip().split(".")[0]
+        packages[package] = packages.get(package, 0) + self_time
+    print("by top-level package (self time): " + ", ".join(
+        f"{package} {seconds * 1000:.0f} ms" for package, seconds in sorted(packages.items(), key=lambda item: -item[1])[:top]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--top", type=int, default=15, help="number of modules to list")
+    parser.add_argument("--repeat", type=int, default=3, help="cold starts to time")
+    args = parser.parse_args()
+
+    api = [json.loads(python(f"HEAVY = {HEAVY_MODULES!r}\n" + API_STARTUP).stdout.splitlines()[-1]) for _ in range(args.repeat)]
+    mcp = [json.loads(python(MCP_STARTUP).stdout.splitlines()[-1]) for _ in range(args.repeat)]
+
+    best = min(api, key=lambda run: run["ready"])
+    print(f"API ready in {best['ready'] * 1000:.0f} ms (best of {args.repeat}), "
+          f"first /get-history answered {best['first_request'] * 1000:.0f} ms later (HTTP {best['status']})")
+    print(f"generation dependencies loaded at startup: {', '.join(best['heavy']) or 'none'}")
+    best = min(mcp, key=lambda run: run["ready"])
+    print(f"MCP server module imported in {best['import'] * 1000:.0f} ms, tools registered at {best['ready'] * 1000:.0f} ms")
+
+    report_imports("src.server", args.top)
+    report_imports("src.services.mcpserver", args.top)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Compares the original two-pass cv2.putText narration overlay with the single-blend text layer.
+Every page of a book has its own narration, so the pipeline always takes the uncached path: that is the number
+that matters, the cached one only applies when the same narration is drawn again (eg. a regenerated page).
+
+Run from backend/: python -m benchmarks.bench_textrender [--repeat N]
+"""
+import argparse
+import glob
+import os
+import textwrap
+import time
+
+import cv2
+
+from src.services import textrender
+
+PAGES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "res", "pages")
+
+NARRATIONS = [
+    "Binky the bunny was scared of everything, even the tiny leaves that rustled in the wind.",
+    "One morning, Ms. Owl told the class they would put on a play in front of the whole school.",
+    "Binky's ears drooped. \"I can't stand up there,\" he whispered to his friend Sam the squirrel.",
+    "Sam smiled and said, \"Being brave doesn't mean you aren't scared. It means you try anyway.\"",
+    "On the day of the play, Binky took a deep breath, hopped onto the stage and said his lines.",
+    "Everyone clapped and cheered, and Binky learned that he was braver than he ever knew.",
+]
+
+
+def legacy_overlay(image, narration):
+    # narration_writer before the text layer engine
+    img_height, img_width, img_channels = image.shape
+    wrapped_text = textwrap.wrap(text=narration, width=50)
+    font = cv2.FONT_HERSHEY_COMPLEX
+    for i, line in enumerate(wrapped_text):
+        textsize = cv2.getTextSize(line, font, 1, 2)[0]
+        gap = textsize[1] + 10
+        starting_y = int(img_height - gap - len(wrapped_text) * gap)
+        y = starting_y + i * gap
+        x = int((img_width - textsize[0]) / 2)
+        cv2.putText(image, line, (x, y), font, 1, (0, 0, 0), 6, lineType=cv2.LINE_AA)
+        cv2.putText(image, line, (x, y), font, 1, (255, 255, 255), 2, lineType=cv2.LINE_AA)
+    return image
+
+
+def bench(name, overlay, pages, repeat, before=None) -> float:
+    timings = []
+    for _ in range(repeat):
+        for image, narration in pages:
+            if before:
+                before()
+            image = image.copy()
+            start = time.perf_counter()
+            overlay(image, narration)
+            timings.append(time.perf_counter() - start)
+    timings.sort()
+    mean = sum(timings) / len(timings)
+    p95 = timings[int(len(timings) * 0.95) - 1]
+    print(f"{name:<28} mean {mean * 1000:7.3f} ms   p95 {p95 * 1000:7.3f} ms   ({len(timings)} overlays)")
+    return mean
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    paths = sorted(glob.glob(os.path.join(PAGES_DIR, "*.png")))
+    pages = [(cv2.imread(path), NARRATIONS[i % len(NARRATIONS)]) for i, path in enumerate(paths)]
+    print(f"{len(pages)} pages from {PAGES_DIR}, {pages[0][0].shape[1]}x{pages[0][0].shape[0]}")
+
+    legacy = bench("legacy cv2.putText x2", legacy_overlay, pages, args.repeat)
+    uncached = bench("text layer (uncached)", textrender.overlay_text, pages, args.repeat, before=textrender.render.cache_clear)
+    print(f"per page in the pipeline: {uncached * 1000:.1f} ms vs {legacy * 1000:.1f} ms legacy ({legacy / uncached:.1f}x)")
+    textrender.render.cache_clear()
+    bench("text layer (cached)", textrender.overlay_text, pages, args.repeat)
+    print(f"render cache: {textrender.render.cache_info()}")
+
+
+if __name__ == "__main__":
+    main()
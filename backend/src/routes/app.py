@@ -1,12 +1,19 @@
-from flask import Flask, Response, json, request, jsonify
+from flask import Flask, Response, json, request, jsonify, send_file
 from flask_cors import CORS
-from ..services.agent import run
+from ..services.jobs import JobQueue, DONE, FAILED
+from ..services.auth import TokenVerifier
+from ..services.quota import create_quota, Reservation, QuotaExceeded, ProfileNotFound
+from ..services.cache import UserCache
+from ..services.runstore import RunStore, PAGE_COUNT
+from ..services.archive import stream_zip
+from ..services import clients, memory, telemetry
 import os
-from supabase import create_client, Client
+import time
+import base64
+import hashlib
+import hmac
+from urllib.parse import quote
 import dotenv
-import tempfile
-from PIL import Image
-from base64 import b64encode
 
 
 def create_app():
@@ -14,10 +21,45 @@ def create_app():
     CORS(app, origins=["https://storybooker.vercel.app", "http://localhost:5173"])
 
     dotenv.load_dotenv()
+    telemetry.configure_tracing()
 
     url = os.environ.get("SUPABASE_URL")
     key = os.environ.get("SUPABASE_SECRET_KEY")
-    supabase = create_client(url, key)
+    supabase = clients.supabase_client()
+    quota = create_quota(supabase)
+    history_cache = UserCache(
+        maxsize=int(os.environ.get("HISTORY_CACHE_SIZE", "1024")),
+        ttl=float(os.environ.get("HISTORY_CACHE_TTL", "10")),
+    )
+    HISTORY_PAGE_SIZE = 20
+    HISTORY_MAX_PAGE_SIZE = 100
+    token_verifier = TokenVerifier(
+        supabase.auth.get_user,
+        jwt_secret=os.environ.get("SUPABASE_JWT_SECRET"),
+        jwks_url=os.environ.get("SUPABASE_JWKS_URL", f"{url}/auth/v1/.well-known/jwks.json"),
+    )
+    storage_http = clients.http_client()
+    run_store = RunStore()
+
+    STORAGE_CHUNK_SIZE = 64 * 1024
+    # conditional / partial request headers passed through to storage
+    STORAGE_REQUEST_HEADERS = ("Range", "If-Range", "If-None-Match", "If-Modified-Since")
+    STORAGE_RESPONSE_HEADERS = ("Content-Length", "Content-Range", "Accept-Ranges", "ETag", "Last-Modified")
+    SSE_MAX_SECONDS = float(os.environ.get("SSE_MAX_SECONDS", "60"))
+    SSE_RECONNECT_MS = 1000
+    BATCH_MAX_BOOKS = int(os.environ.get("BATCH_MAX_BOOKS", "100"))
+    GENERATE_BATCH_MAX_BOOKS = int(os.environ.get("GENERATE_BATCH_MAX_BOOKS", "10"))
+
+    @app.route("/metrics", methods = ["GET"])
+    def metrics():
+        # Prometheus text format behind the METRICS_TOKEN bearer token; without a token configured there is no endpoint
+        metrics_token = os.environ.get("METRICS_TOKEN")
+        if not metrics_token:
+            return jsonify({"error": "Not found"}), 404
+        if not hmac.compare_digest(request.headers.get("Authorization", ""), "Bearer " + metrics_token):
+            return jsonify({"error": "Missing or invalid authorization token"}), 401
+        telemetry.process_rss_bytes.set(memory.rss_bytes())
+        return Response(telemetry.registry.render(), mimetype="text/plain; version=0.0.4")
 
     # TODO user should be able to:
     # update profile (email, password, etc.)
@@ -124,7 +166,7 @@ def create_app():
             access_token = auth_header.split(" ")[1]  # "Bearer <jwt token>"
             
         try:
-            user = supabase.auth.get_user(access_token).user
+            user = token_verifier.verify(access_token)
             if not user:
                 return None, (jsonify({"error": "Invalid or expired authorization token"}), 401)
             
@@ -132,67 +174,390 @@ def create_app():
         except Exception as e:
             return None, (jsonify({"error": str(e)}), 401)
         
+    def book_error(title, prompt) -> str:
+        # checked before a generation is reserved; a bad title would otherwise only fail after every model call
+        if not isinstance(title, str) or not title.strip():
+            return "Missing storybook title"
+        if not isinstance(prompt, str) or not prompt.strip():
+            return "Missing storybook prompt"
+        return None
+
     @app.route("/generate", methods = ["POST"])
     def generate():
         user, error = get_current_user()
         if not user or error:
             return error
         
-        data = request.json
+        data = request.get_json(silent=True) or {}
         title = data.get("title")
         prompt = data.get("prompt")
+        error = book_error(title, prompt)
+        if error:
+            return jsonify({"error": error}), 400
         
-        profile = supabase.table("profiles").select("*").eq("user_id", user.id).maybe_single().execute().data
-        if not profile:
+        try:
+            reservation = quota.reserve(user.id)
+        except ProfileNotFound:
             return jsonify({"error": "User profile not found"}), 404
-        remaining_gens = profile.get("remaining_gens")
-        if remaining_gens is None or remaining_gens <= 0:
+        except QuotaExceeded:
             return jsonify({"error": "No remaining storybook generations. Please upgrade your plan."}), 403
+        except Exception as e:
+            return jsonify({"error": str(e)}), 503
+        
+        try:
+            job_id = jobs.submit(user.id, title, prompt)
+        except Exception as e:
+            reservation.refund()
+            return jsonify({"error": str(e)}), 500
+        return jsonify({"message": "Storybook generation started", "job_id": job_id, "status": "queued"}), 202
+
+    def reserve_generations(user_id: str, count: int) -> list:
+        # all or nothing: the generations already reserved are refunded if one of them fails
+        reservations = []
+        try:
+            for _ in range(count):
+                reservations.append(quota.reserve(user_id))
+        except Exception:
+            for reservation in reservations:
+                reservation.refund()
+            raise
+        return reservations
+
+    @app.route("/generate-batch", methods = ["POST"])
+    def generate_batch():
+        # books of one batch are generated together: shared characters are made once and all scenes share one executor
+        user, error = get_current_user()
+        if not user or error:
+            return error
         
-        # decrement remaining_gens
-        supabase.table("profiles").update({"remaining_gens": remaining_gens - 1}).eq("user_id", user.id).execute()
+        books = (request.get_json(silent=True) or {}).get("books")
+        if not isinstance(books, list) or not books or not all(isinstance(book, dict) for book in books):
+            return jsonify({"error": "books must be a list of {title, prompt}"}), 400
+        if len(books) > GENERATE_BATCH_MAX_BOOKS:
+            return jsonify({"error": f"At most {GENERATE_BATCH_MAX_BOOKS} storybooks per batch"}), 400
+        for index, book in enumerate(books):
+            error = book_error(book.get("title"), book.get("prompt"))
+            if error:
+                return jsonify({"error": f"Book {index + 1}: {error}"}), 400
         
-        # run agent
-        pdf_bytes = run(prompt)
+        try:
+            reservations = reserve_generations(user.id, len(books))
+        except ProfileNotFound:
+            return jsonify({"error": "User profile not found"}), 404
+        except QuotaExceeded:
+            return jsonify({"error": "Not enough remaining storybook generations for this batch. Please upgrade your plan."}), 403
+        except Exception as e:
+            return jsonify({"error": str(e)}), 503
+        
+        try:
+            batch_id, job_ids = jobs.submit_batch(user.id, [(book.get("title"), book.get("prompt")) for book in books])
+        except Exception as e:
+            for reservation in reservations:
+                reservation.refund()
+            return jsonify({"error": str(e)}), 500
+        return jsonify({"message": "Storybook generation started", "batch_id": batch_id, "job_ids": job_ids, "status": "queued"}), 202
+
+    def generate_job(job, emit) -> bytes:
+        # runs on a job worker thread, outside of any request; the generation reserved in /generate
+        # is only spent once the storybook is stored
+        # the generation stack (pipeline, OpenCV, model clients) is imported by the first job, not at startup,
+        # so a cold worker answers auth and history requests without loading it
+        from ..services.agent import run
+
+        reservation = Reservation(quota, job["user_id"])
+        run_store.prune()
+        try:
+            # checkpoints are kept per job, so a retried job resumes where it stopped
+            pdf_bytes = store_storybook(job, run(job["prompt"], on_event=emit, checkpoints=run_store.open(job["id"])))
+        except Exception:
+            reservation.refund()
+            raise
+        reservation.commit()
+        return pdf_bytes
+
+    def store_storybook(job, pdf_bytes: bytes) -> bytes:
         if not pdf_bytes:
-            return jsonify({"error": "Storybook generation failed"}), 500
+            raise RuntimeError("Storybook generation failed")
         
-        filename = title[:50].replace(" ", "_") + ".pdf"
-        upload_url = (
-            supabase.storage.from_("storybook_pdfs").create_signed_upload_url(user.id + "/" + filename) # TODO could be security concern; replace signed upload url with diff method 
-        )
-        upload_response = (
-            supabase.storage
-            .from_("storybook_pdfs")
-            .upload_to_signed_url(
-                path=user.id + "/" + filename,
-                token=upload_url["token"],
-                file=pdf_bytes,
+        user_id = job["user_id"]
+        filename = job["title"][:50].replace(" ", "_") + ".pdf"
+        if job["result_path"]:
+            # this job already stored its storybook (eg. a page was regenerated): replace the file, keep the row
+            with telemetry.stage("storage_upload", provider="supabase", replace=True) as stage:
+                supabase.storage.from_("storybook_pdfs").update(
+                    path=user_id + "/" + filename,
+                    file=pdf_bytes,
+                    file_options={"content-type": "application/pdf"},
+                )
+                stage.record(bytes_in=len(pdf_bytes))
+            history_cache.invalidate(user_id)
+            return pdf_bytes
+
+        with telemetry.stage("storage_upload", provider="supabase", replace=False) as stage:
+            upload_url = (
+                supabase.storage.from_("storybook_pdfs").create_signed_upload_url(user_id + "/" + filename) # TODO could be security concern; replace signed upload url with diff method 
             )
+            upload_response = (
+                supabase.storage
+                .from_("storybook_pdfs")
+                .upload_to_signed_url(
+                    path=user_id + "/" + filename,
+                    token=upload_url["token"],
+                    file=pdf_bytes,
+                )
+            )
+            stage.record(bytes_in=len(pdf_bytes))
+        
+        with telemetry.stage("db_insert", provider="supabase"):
+            supabase.table("storybooks").insert({
+                "user_id": user_id,
+                "title": job["title"],
+                "prompt": job["prompt"],
+                "pdf_path": user_id + "/" + filename
+            }).execute()
+        history_cache.invalidate(user_id)
+        
+        return pdf_bytes
+
+    def generate_batch_jobs(batch, emit) -> list:
+        # like generate_job for several jobs at once; each job spends or refunds its own generation
+        from ..services.agent import run_batch
+
+        run_store.prune()
+        try:
+            pdfs = run_batch(
+                [job["prompt"] for job in batch],
+                on_event=lambda book, event, data: emit(batch[book]["id"], event, data),
+                checkpoints=[run_store.open(job["id"]) for job in batch],
+            )
+        except Exception as e:
+            pdfs = [e] * len(batch)
+        
+        results = []
+        for job, pdf_bytes in zip(batch, pdfs):
+            reservation = Reservation(quota, job["user_id"])
+            try:
+                if isinstance(pdf_bytes, Exception):
+                    raise pdf_bytes
+                results.append(store_storybook(job, pdf_bytes))
+            except Exception as e:
+                reservation.refund()
+                results.append(e)
+                continue
+            reservation.commit()
+        return results
+
+    def abandon_job(job):
+        # the job's worker process died too often; give back the generation reserved for it
+        Reservation(quota, job["user_id"]).refund()
+
+    jobs = JobQueue(generate_job, batch_handler=generate_batch_jobs, on_abandon=abandon_job)
+    # queued jobs (and jobs whose worker died) are picked up without waiting for the next submit
+    jobs.start()
+
+    def get_user_job(job_id: str, access_token: str = None):
+        user, error = get_current_user(access_token)
+        if not user or error:
+            return None, error
+        
+        job = jobs.get(job_id)
+        if not job or job["user_id"] != user.id:
+            return None, (jsonify({"error": "Job not found"}), 404)
+        return job, None
+
+    @app.route("/jobs/<job_id>", methods = ["GET"])
+    def job_status(job_id):
+        job, error = get_user_job(job_id)
+        if not job:
+            return error
+        
+        return jsonify({
+            "id": job["id"],
+            "status": job["status"],
+            "title": job["title"],
+            "error": job["error"],
+            "created_at": job["created_at"],
+            "updated_at": job["updated_at"],
+        }), 200
+
+    @app.route("/batches/<batch_id>", methods = ["GET"])
+    def batch_status(batch_id):
+        user, error = get_current_user()
+        if not user or error:
+            return error
+        
+        batch = [job for job in jobs.batch(batch_id) if job["user_id"] == user.id]
+        if not batch:
+            return jsonify({"error": "Batch not found"}), 404
+        return jsonify({
+            "id": batch_id,
+            "jobs": [{
+                "id": job["id"],
+                "status": job["status"],
+                "title": job["title"],
+                "error": job["error"],
+            } for job in batch],
+        }), 200
+
+    def requeue_job(job, status: str, before_requeue=None):
+        try:
+            reservation = quota.reserve(job["user_id"])
+        except QuotaExceeded:
+            return jsonify({"error": "No remaining storybook generations. Please upgrade your plan."}), 403
+        except Exception as e:
+            return jsonify({"error": str(e)}), 503
+        
+        if before_requeue:
+            before_requeue()
+        after = jobs.requeue(job["id"], status)
+        if after is None:
+            reservation.refund()
+            return jsonify({"error": "Job is not " + status}), 409
+        # events with a sequence number up to `after` belong to the previous run
+        return jsonify({"message": "Storybook generation started", "job_id": job["id"], "status": "queued", "after": after}), 202
+
+    @app.route("/jobs/<job_id>/retry", methods = ["POST"])
+    def retry_job(job_id):
+        job, error = get_user_job(job_id)
+        if not job:
+            return error
+        if job["status"] != FAILED:
+            return jsonify({"error": "Only failed jobs can be retried"}), 409
+        
+        # resumes from the job's checkpoints; only missing stages are generated again
+        return requeue_job(job, FAILED)
+
+    @app.route("/jobs/<job_id>/pages/<int:page>/regenerate", methods = ["POST"])
+    def regenerate_page(job_id, page):
+        job, error = get_user_job(job_id)
+        if not job:
+            return error
+        if job["status"] != DONE:
+            return jsonify({"error": "Storybook is not ready yet", "status": job["status"]}), 409
+        if not 1 <= page <= PAGE_COUNT:
+            return jsonify({"error": f"Page must be between 1 and {PAGE_COUNT}"}), 400
+        if not run_store.exists(job_id):
+            return jsonify({"error": "This storybook can no longer be edited"}), 410
+        
+        return requeue_job(job, DONE, before_requeue=lambda: run_store.open(job_id).discard_page(page))
+
+    @app.route("/jobs/<job_id>/result", methods = ["GET"])
+    def job_result(job_id):
+        access_token = request.args.get("access_token")
+        job, error = get_user_job(job_id, access_token)
+        if not job:
+            return error
+        
+        if job["status"] == FAILED:
+            return jsonify({"error": job["error"] or "Storybook generation failed"}), 500
+        if job["status"] != DONE:
+            return jsonify({"error": "Storybook is not ready yet", "status": job["status"]}), 409
+        
+        # raw PDF with ETag and Range support instead of base64 in JSON
+        return send_file(
+            job["result_path"],
+            mimetype="application/pdf",
+            download_name=job["title"][:50].replace(" ", "_") + ".pdf",
+            conditional=True,
+            etag=True,
         )
+
+    @app.route("/jobs/<job_id>/events", methods = ["GET"])
+    def job_events(job_id):
+        # EventSource cannot set headers, so the token may also come as a query parameter
+        access_token = request.args.get("access_token")
+        job, error = get_user_job(job_id, access_token)
+        if not job:
+            return error
         
-        supabase.table("storybooks").insert({
-            "user_id": user.id,
-            "title": title,
-            "prompt": prompt,
-            "pdf_path": user.id + "/" + filename
-        }).execute()
+        try:
+            last_seq = int(request.headers.get("Last-Event-ID") or request.args.get("after") or 0)
+        except ValueError:
+            return jsonify({"error": "Last-Event-ID and after must be event sequence numbers"}), 400
+
+        def stream():
+            seq = last_seq
+            opened = last_sent = time.monotonic()
+            # tell EventSource how soon to reconnect when the stream is closed below
+            yield f"retry: {SSE_RECONNECT_MS}\n\n"
+            while True:
+                for event in jobs.events(job_id, seq):
+                    seq = event["seq"]
+                    last_sent = time.monotonic()
+                    yield f"id: {seq}\nevent: {event['event']}\ndata: {json.dumps(event['data'])}\n\n"
+                    if event["event"] in (DONE, FAILED):
+                        return
+                if time.monotonic() - opened > SSE_MAX_SECONDS:
+                    # bounded, so a stream never holds a server thread for a whole job;
+                    # the client reconnects with Last-Event-ID and continues where it stopped
+                    return
+                if time.monotonic() - last_sent > 15:
+                    last_sent = time.monotonic()
+                    yield ": keep-alive\n\n"
+                time.sleep(0.5)
+
+        return Response(stream(), mimetype="text/event-stream", headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+        })
         
-        return jsonify({"message": "Storybook generated successfully", "pdf_data": b64encode(pdf_bytes).decode("utf-8")}), 200
+    def encode_cursor(book) -> str:
+        return base64.urlsafe_b64encode(json.dumps([book["created_at"], book["id"]]).encode()).decode()
+
+    def decode_cursor(cursor: str):
+        # cursors come back from clients; anything not made by encode_cursor is refused before it reaches a query
+        try:
+            created_at, book_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        except (ValueError, TypeError):
+            raise ValueError("Invalid cursor")
+        if not all(isinstance(value, str) and '"' not in value and "\\" not in value for value in (created_at, book_id)):
+            raise ValueError("Invalid cursor")
+        return created_at, book_id
+
+    def history_page(user_id: str, limit: int, cursor: str):
+        # keyset pagination on (created_at, id), newest first
+        query = supabase.table("storybooks").select("id, title, created_at").eq("user_id", user_id)
+        if cursor:
+            created_at, book_id = decode_cursor(cursor)
+            query = query.or_(f'created_at.lt."{created_at}",and(created_at.eq."{created_at}",id.lt."{book_id}")')
+        storybooks = query.order("created_at", desc=True).order("id", desc=True).limit(limit + 1).execute().data
         
+        history = [{"id": book["id"], 
+                    "title": book["title"], 
+                    "date": book["created_at"]} 
+                for book in storybooks[:limit]]
+        next_cursor = encode_cursor(storybooks[limit - 1]) if len(storybooks) > limit else None
+        body = json.dumps({"history": history, "next_cursor": next_cursor})
+        return body, '"' + hashlib.sha256(body.encode()).hexdigest()[:32] + '"'
+
     @app.route("/get-history", methods = ["GET"])
     def get_history():
         user, error = get_current_user()
         if not user or error:
             return error
         
+        limit = request.args.get("limit", str(HISTORY_PAGE_SIZE))
+        if not limit.isdigit():
+            return jsonify({"error": "limit must be a positive whole number"}), 400
+        limit = min(max(int(limit), 1), HISTORY_MAX_PAGE_SIZE)
+        cursor = request.args.get("cursor")
+        if cursor:
+            try:
+                decode_cursor(cursor)
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+        
         try:
-            storybooks = supabase.table("storybooks").select("id, title, created_at").eq("user_id", user.id).order("created_at", desc=True).execute().data
-            history = [{"id": book["id"], 
-                        "title": book["title"], 
-                        "date": book["created_at"]} 
-                    for book in storybooks]
-            return jsonify({"history": history}), 200
+            page = history_cache.get(user.id, (limit, cursor))
+            if page is None:
+                page = history_page(user.id, limit, cursor)
+                history_cache.put(user.id, (limit, cursor), page)
+            body, etag = page
+            
+            headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+            if etag in request.headers.get("If-None-Match", ""):
+                return Response(status=304, headers=headers)
+            return Response(body, status=200, mimetype="application/json", headers=headers)
         except Exception as e:
             return jsonify({"error": str(e)}), 400
         
@@ -212,18 +577,43 @@ def create_app():
             if not storybook_data:
                 return jsonify({"error": "Storybook not found"}), 404
             
-            pdf_data = supabase.storage.from_("storybook_pdfs").download(storybook_data["pdf_path"])
-
             filename = storybook_data["title"][:50].replace(" ", "_") + ".pdf"
-            return Response(
-                pdf_data,
-                mimetype="application/pdf",
-                headers={
-                    "Content-Disposition": f"attachment; filename={filename}"
-                }
-            )
+            return stream_storage_pdf(storybook_data["pdf_path"], filename)
         except Exception as e:
             return jsonify({"error": str(e)}), 400
+
+    def open_storage_pdf(pdf_path: str, headers: dict = None):
+        # streamed GET over the pooled client; the caller reads and closes the response
+        # identity keeps Content-Length/Content-Range valid for the bytes we pass on
+        headers = {"Authorization": f"Bearer {key}", "apikey": key, "Accept-Encoding": "identity", **(headers or {})}
+        return storage_http.send(
+            storage_http.build_request("GET", f"{url}/storage/v1/object/storybook_pdfs/{quote(pdf_path)}", headers=headers),
+            stream=True,
+        )
+
+    def stream_storage_pdf(pdf_path: str, filename: str):
+        # proxies the object in chunks, passing Range/ETag handling through to storage
+        headers = {header: request.headers[header] for header in STORAGE_REQUEST_HEADERS if header in request.headers}
+        upstream = open_storage_pdf(pdf_path, headers)
+        if upstream.status_code not in (200, 206, 304, 416):
+            upstream.read()
+            upstream.close()
+            return jsonify({"error": f"Could not download storybook ({upstream.status_code})"}), 400
+        
+        def body():
+            try:
+                yield from upstream.iter_bytes(STORAGE_CHUNK_SIZE)
+            finally:
+                upstream.close()
+
+        response_headers = {
+            "Content-Disposition": f"attachment; filename={filename}",
+            "Cache-Control": "private, no-cache",
+        }
+        for header in STORAGE_RESPONSE_HEADERS:
+            if header in upstream.headers:
+                response_headers[header] = upstream.headers[header]
+        return Response(body(), status=upstream.status_code, mimetype="application/pdf", headers=response_headers)
         
     @app.route("/book/delete", methods = ["DELETE"])
     def delete():
@@ -242,6 +632,7 @@ def create_app():
                 return jsonify({"error": "Storybook not found"}), 404
             
             table_delete_response = supabase.table("storybooks").delete().eq("id", storybook_id).eq("user_id", user.id).execute()
+            history_cache.invalidate(user.id)
             if not table_delete_response:
                 return jsonify({"error": "Could not delete storybook from database"}), 400
             
@@ -253,4 +644,129 @@ def create_app():
         except Exception as e:
             return jsonify({"error": str(e)}), 400
         
+
+    def batch_ids(max_books: int = BATCH_MAX_BOOKS):
+        # IDs come as a JSON list "storybook_ids" or as a comma separated query parameter
+        body = request.get_json(silent=True) or {}
+        ids = body.get("storybook_ids")
+        if ids is None:
+            ids = [i for i in request.args.get("storybook_ids", "").split(",") if i]
+        if not isinstance(ids, list) or not all(isinstance(i, str) for i in ids):
+            raise ValueError("storybook_ids must be a list of storybook IDs")
+        ids = list(dict.fromkeys(ids))
+        if len(ids) > max_books:
+            raise ValueError(f"At most {max_books} storybooks per request")
+        return ids
+
+    def owned_storybooks(user_id: str, ids: list, columns: str = "id, title, prompt, pdf_path, created_at"):
+        # one ownership query for the whole batch; an empty list selects the user's whole library,
+        # read BATCH_MAX_BOOKS rows at a time so that no book is left out
+        if ids:
+            return supabase.table("storybooks").select(columns).eq("user_id", user_id).in_("id", ids).execute().data
+        storybooks = []
+        while True:
+            page = (supabase.table("storybooks").select(columns).eq("user_id", user_id)
+                    .order("created_at", desc=True).order("id")
+                    .range(len(storybooks), len(storybooks) + BATCH_MAX_BOOKS - 1).execute().data)
+            storybooks.extend(page)
+            if len(page) < BATCH_MAX_BOOKS:
+                return storybooks
+
+    @app.route("/book/delete-batch", methods = ["POST", "DELETE"])
+    def delete_batch():
+        access_token = request.args.get("access_token")
+        user, error = get_current_user(access_token)
+        if not user or error:
+            return error
+        
+        try:
+            ids = batch_ids()
+            if not ids:
+                return jsonify({"error": "Missing storybook IDs"}), 400
+            storybooks = owned_storybooks(user.id, ids, "id, pdf_path")
+            found = [book["id"] for book in storybooks]
+            not_found = [i for i in ids if i not in set(found)]
+            if not found:
+                return jsonify({"error": "Storybooks not found", "not_found": not_found}), 404
+            
+            table_delete_response = supabase.table("storybooks").delete().in_("id", found).eq("user_id", user.id).execute()
+            history_cache.invalidate(user.id)
+            if not table_delete_response:
+                return jsonify({"error": "Could not delete storybooks from database"}), 400
+            
+            pdf_paths = [book["pdf_path"] for book in storybooks if book.get("pdf_path")]
+            if pdf_paths:
+                storage_delete_response = supabase.storage.from_("storybook_pdfs").remove(pdf_paths)
+                if not storage_delete_response:
+                    return jsonify({"error": "Could not delete storybooks from storage"}), 400
+            
+            return jsonify({"message": "Storybooks deleted successfully", "deleted": found, "not_found": not_found}), 200
+        except Exception as e:
+            return jsonify({"error": str(e)}), 400
+
+    def archive_name(title: str, taken: set) -> str:
+        stem = (title or "storybook")[:50].replace(" ", "_").replace("/", "_") or "storybook"
+        name, n = stem + ".pdf", 2
+        while name in taken:
+            name, n = f"{stem}_{n}.pdf", n + 1
+        taken.add(name)
+        return name
+
+    def storage_chunks(pdf_path: str):
+        upstream = open_storage_pdf(pdf_path)
+        try:
+            if upstream.status_code != 200:
+                upstream.read()
+                raise RuntimeError(f"Could not download {pdf_path} ({upstream.status_code})")
+            yield from upstream.iter_bytes(STORAGE_CHUNK_SIZE)
+        finally:
+            upstream.close()
+
+    @app.route("/book/download-batch", methods = ["GET", "POST"])
+    def download_batch():
+        # zip of the requested storybooks (the whole library when no IDs are given) plus a history.json export;
+        # PDFs are streamed from storage one after another straight into the response, never held in full
+        access_token = request.args.get("access_token")
+        user, error = get_current_user(access_token)
+        if not user or error:
+            return error
+        
+        try:
+            ids = batch_ids()
+            storybooks = owned_storybooks(user.id, ids)
+            if ids:
+                order = {book_id: index for index, book_id in enumerate(ids)}
+                storybooks.sort(key=lambda book: order[book["id"]])
+            if not storybooks:
+                return jsonify({"error": "Storybooks not found"}), 404
+        except Exception as e:
+            return jsonify({"error": str(e)}), 400
+        
+        taken = {"history.json"}
+        history = []
+        failed = []
+        
+        def entries():
+            for book in storybooks:
+                filename = archive_name(book["title"], taken)
+                history.append({"id": book["id"], "title": book["title"], "prompt": book.get("prompt"),
+                                "date": book["created_at"], "file": filename})
+                yield filename, storage_chunks(book["pdf_path"])
+            # the status and headers are sent before any PDF is fetched, so a PDF that cannot be read is not
+            # an error response: it is left out of the archive (or cut short) and marked here
+            errors = {name: (str(e), written) for name, e, written in failed}
+            for item in history:
+                if item["file"] in errors:
+                    message, written = errors[item["file"]]
+                    item["error"] = message + (" (the file is incomplete)" if written else "")
+                    if not written:
+                        item["file"] = None
+            yield "history.json", [json.dumps({"history": history}, indent=2).encode("utf-8")]
+        
+        return Response(stream_zip(entries(), failed), status=200, mimetype="application/zip", headers={
+            "Content-Disposition": "attachment; filename=storybooks.zip",
+            "Cache-Control": "private, no-cache",
+            "X-Accel-Buffering": "no",
+        })
+
     return app
\ No newline at end of file
@@ -1,135 +1,232 @@
 import os
-from strands import Agent
-from strands.models.openai import OpenAIModel
-from strands.tools.mcp import MCPClient
-from mcp.client.stdio import stdio_client, StdioServerParameters
 from dotenv import load_dotenv
+import io
 import tempfile
 from PIL import Image
+from .pipeline import run_pipeline, run_batch as run_pipeline_batch, to_image
+from .pdf import PDFWriter, build_pdf
+from .runstore import PAGE_COUNT, Run
+from . import memory, telemetry
 
-def run(user_input: str) -> bytes:
-    with tempfile.TemporaryDirectory() as temp_dir:
+# "orchestrator" calls the tools from code as a parallel pipeline; "agent" lets an LLM drive them one call at a time
+PIPELINE_MODE = os.environ.get("PIPELINE_MODE", "orchestrator")
+AGENT_MAX_CONTINUES = int(os.environ.get("AGENT_MAX_CONTINUES", "2"))
+
+def read_pages(in_dir: str):
+    # one decoded page at a time
+    for index in range(1, PAGE_COUNT + 1):
+        with Image.open(f"{in_dir}/scene_{index}_narrated.png") as page:
+            yield page
+
+def missing_pages(in_dir: str) -> list:
+    return [index for index in range(1, PAGE_COUNT + 1) if not os.path.exists(f"{in_dir}/scene_{index}_narrated.png")]
+
+def compile_pdf(in_dir: str) -> bytes:
+    pdf_bytes = build_pdf(read_pages(in_dir))
+    print(f"PDF compiled: {len(pdf_bytes)} bytes")
+    return pdf_bytes
+
+def run(user_input: str, on_event=None, checkpoints: Run = None) -> bytes:
+    """
+    Purpose: Generates a storybook PDF for the user prompt
+    Input: on_event(event, data) receives progress events (orchestrator mode only)
+           checkpoints is where intermediate artifacts are kept so a later call can resume;
+           without it they live in a temporary directory and are lost when the call returns
+    Output: PDF bytes; in orchestrator mode a failed generation raises its error, in agent mode it returns None
+    """
+    load_dotenv()
+    mode = os.environ.get("PIPELINE_MODE", PIPELINE_MODE)
+    with tempfile.TemporaryDirectory() as scratch_dir:
+        checkpoints = checkpoints or Run(scratch_dir)
+        if mode == "agent":
+            return run_agent(user_input, checkpoints.directory)
+        return run_orchestrator(user_input, checkpoints, on_event)
+
+def run_batch(user_inputs: list, on_event=None, checkpoints: list = None) -> list:
+    """
+    Purpose: Generates several storybook PDFs together, sharing characters and one pool of tool calls between them
+    Input: user_inputs are the user prompts, one per book
+           on_event(book, event, data) receives progress events, book being the position of the prompt
+           checkpoints are the Runs of the books, as in run(); temporary ones are used when they are not given
+    Output: PDF bytes for each book, or the exception that stopped it for the books whose generation failed
+            (None in agent mode)
+    """
+    load_dotenv()
+    if os.environ.get("PIPELINE_MODE", PIPELINE_MODE) == "agent":
+        # the agent drives one book at a time
+        return [run(user_input, checkpoints=checkpoints[book] if checkpoints else None)
+                for book, user_input in enumerate(user_inputs)]
+    with tempfile.TemporaryDirectory() as scratch_dir:
+        checkpoints = checkpoints or [Run(os.path.join(scratch_dir, str(book))) for book in range(len(user_inputs))]
+        buffers = [io.BytesIO() for _ in user_inputs]
+        writers = [PDFWriter(buffer) for buffer in buffers]
+
+        def add_page(book, index, page):
+            with telemetry.stage("pdf_page", page=index), memory.held() as held:
+                held.add(page.nbytes)  # the RGB copy
+                writers[book].add_page(to_image(page), index)
+
+        pdfs = []
+        outcomes = run_pipeline_batch(user_inputs, checkpoints, on_event=on_event, on_page=add_page)
+        for book, outcome in enumerate(outcomes):
+            if isinstance(outcome, Exception):
+                print(f"PIPELINE FAILED for book {book}: " + str(outcome))
+                pdfs.append(outcome)
+                continue
+            with telemetry.stage("pdf_compile") as stage, memory.held() as held:
+                size = writers[book].close()
+                held.add(2 * size)  # the buffer and the copy returned
+                stage.record(bytes_out=size)
+                pdfs.append(buffers[book].getvalue())
+            print(f"PDF compiled: {size} bytes")
+        return pdfs
+
+def run_orchestrator(user_input: str, checkpoints: Run, on_event=None) -> bytes:
+    print(f"Running pipeline in {checkpoints.directory}")
+    # pages are compressed into the PDF as they finish instead of being held until the end
+    buffer = io.BytesIO()
+    pdf = PDFWriter(buffer)
+
+    def add_page(index, page):
+        with telemetry.stage("pdf_page", page=index), memory.held() as held:
+            held.add(page.nbytes)  # the RGB copy
+            pdf.add_page(to_image(page), index)
+
+    try:
+        run_pipeline(user_input, checkpoints, on_event=on_event, on_page=add_page)
+    except Exception as e:
+        # the error itself goes to the job, so the user sees why the book failed
+        print("PIPELINE FAILED: " + str(e))
+        raise
+    with telemetry.stage("pdf_compile") as stage, memory.held() as held:
+        size = pdf.close()
+        held.add(2 * size)  # the buffer and the copy returned
+        stage.record(bytes_out=size)
+        pdf_bytes = buffer.getvalue()
+    print(f"PDF compiled: {size} bytes")
+    return pdf_bytes
+
+def run_agent(user_input: str, temp_dir: str) -> bytes:
+    # strands and the MCP server pool are only needed in this mode
+    from strands import Agent
+    from strands.models.openai import OpenAIModel
+    from .mcppool import get_pool
+
+    print(f"Using temporary directory: {temp_dir}")
+
+    print("Setting up OpenAI model...")
+    model = OpenAIModel(
+        client_args={
+            "api_key": os.environ.get("OPENAI_API_KEY"),
+        },
+        model_id="gpt-4.1-nano",
+        params={
+            "max_tokens": 5000,
+            "temperature": 0.7,
+        }
+    )
+
+    try:
         print("Connecting to server...")
-        print(f"Using temporary directory: {temp_dir}")
-        mcp_client = MCPClient(lambda: stdio_client(StdioServerParameters(
-            command="python",
-            args=["src/services/mcpserver.py"] # docker deployment copies /backend to /app as WORKDIR; use ../services/mcpserver.py if running local
-        )))
-
-        print("Setting up OpenAI model...")
-        load_dotenv()
-        model = OpenAIModel(
-            client_args={
-                "api_key": os.environ.get("OPENAI_API_KEY"),
-            },
-            model_id="gpt-4.1-nano",
-            params={
-                "max_tokens": 5000,
-                "temperature": 0.7,
-            }
-        )
-
-        try:
-            with mcp_client:
-                agent = Agent(
-                    model=model,
-                    system_prompt="""
-                    # Role
-                    You are an AI agent that generates complete illustrated children's storybooks (picture books) from a single user prompt. The user provides only one prompt describing their requirements, and you handle all steps of planning, illustration, narration overlay, and scene assembly to produce a coherent 6-page storybook.
-
-                    You have access to three specialized tools:
-
-                    1. storyboarder - generates the structured storyboard plan.
-                    2. character_base_image_gen - generates consistent base images for each unique character.
-                    3. scene_creator - composes characters with a background into a final illustrated page.
-                    4. narration_writer - overlays narration text on the final scene image.
-
-                    Your job is to coordinate these tools and ensure that all 6 pages are generated with characters remain consistent across pages, backgrounds match the narration, and the final book is cohesive.
-
-                    # Workflow
-                    1. Take Input
-                        - Accept a single freeform prompt from the user describing the requirements for the storybook (e.g., theme, moral, style, or characters they want).
-                    2. Generate Storyboard
-                        - Call storyboarder with the user's prompt.
-                        - Receive a 6-page plan in dictionary format:
-                            [
-                                {"characters": [{"name": "...",
-                                                "description": "..."},
-                                                ...
-                                            ], 
-                                "background": "...", 
-                                "narration": "..." },
-                                ...
-                            ]
-                        - Verify that exactly 6 entries exist; if fewer or more, regenerate until there are exactly 6.
-                        - Wait until this step is fully completed before proceeding.
-                    3. Prepare Characters
-                        - Collect all unique characters across the storyboard.
-                        - For each character:
-                            - Call character_base_image_gen with:
-                                - name (all lowercase, spaces replaced with underscores)
-                                - description (physical traits)
-                                - output_directory (temp_dir)
-                            - Save generated base images in {temp_dir}/{name}.png.
-                        - Wait until all unique characters are generated before proceeding.
-                    4. Generate Scenes
-                        - For each storyboard page (1-6):
-                            - Construct a requirements string combining the background, narration context, and character placements.
-                            - Call scene_creator with:
-                                - requirements (scene description with characters, background, narration guidance)
-                                - scene_index (page number 1-6)
-                                - images (list of character base image filenames).
-                                - output_directory (temp_dir)
-                            - Store final scene image in {temp_dir}/scene_{scene_index}.png.
-                        - Wait until all 6 scenes are generated before proceeding.
-                    5. Add Narration to Scenes
-                        - For each generated scene:
-                            - Call narration_writer with:
-                                - scene_index (page number)
-                                - narration (text from the storyboard for that page)
-                                - output_directory (temp_dir)
-                            - Store the final scene with narration in {temp_dir}/scene_{scene_index}_narrated.png.
-                        - Wait until this step is fully completed before proceeding.
-                            
-                    6. Return the string "all done" once all of steps 1-5 are fully completed.
-
-                    # Constraints
-                    1. Always generate exactly 6 pages. Do not output fewer or more.
-                    2. Always ensure character consistency across all pages by reusing their base images.
-                    3. Narration should be short, simple, and engaging for children.
-                    4. Scenes must clearly reflect narration and emotional tone.
-                    5. If ambiguity arises in user prompt, make reasonable assumptions and proceed.
-                    6. You must keep calling tools until the final illustrated book is ready. Do not ask the user anything in between.
-                    7. You must follow your workflow sequentially from 1-6 and not skip steps.
-                    """ + 
-                    f"""
-                    # Constants
-                    1. temp_dir = {temp_dir}
-                    """,
-                    )
-                
-                mcp_tools = mcp_client.list_tools_sync()
-                print(f"Available tools: {[tool.tool_name for tool in mcp_tools]}")
-                
-                agent.tool_registry.process_tools(mcp_tools)
-                
-                result = agent(user_input)
-                
-                print("last response: " + result.__str__())
-                while "all done" not in result.__str__().lower():
-                    print("Continuing agent tasks...")
-                    result = agent(input())
-                print("Agent finished all tasks.")
+        with get_pool().session() as mcp_session:
+            agent = Agent(
+                model=model,
+                system_prompt="""
+                # Role
+                You are an AI agent that generates complete illustrated children's storybooks (picture books) from a single user prompt. The user provides only one prompt describing their requirements, and you handle all steps of planning, illustration, narration overlay, and scene assembly to produce a coherent 6-page storybook.
+
+                You have access to three specialized tools:
+
+                1. storyboarder - generates the structured storyboard plan.
+                2. character_base_image_gen - generates consistent base images for each unique character.
+                3. scene_creator - composes characters with a background into a final illustrated page.
+                4. narration_writer - overlays narration text on the final scene image.
+
+                Your job is to coordinate these tools and ensure that all 6 pages are generated with characters remain consistent across pages, backgrounds match the narration, and the final book is cohesive.
+
+                # Workflow
+                1. Take Input
+                    - Accept a single freeform prompt from the user describing the requirements for the storybook (e.g., theme, moral, style, or characters they want).
+                2. Generate Storyboard
+                    - Call storyboarder with the user's prompt.
+                    - Receive a 6-page plan in dictionary format:
+                        [
+                            {"characters": [{"name": "...",
+                                            "description": "..."},
+                                            ...
+                                        ], 
+                            "background": "...", 
+                            "narration": "..." },
+                            ...
+                        ]
+                    - Verify that exactly 6 entries exist; if fewer or more, regenerate until there are exactly 6.
+                    - Wait until this step is fully completed before proceeding.
+                3. Prepare Characters
+                    - Collect all unique characters across the storyboard.
+                    - For each character:
+                        - Call character_base_image_gen with:
+                            - name (all lowercase, spaces replaced with underscores)
+                            - description (physical traits)
+                            - output_directory (temp_dir)
+                        - Save generated base images in {temp_dir}/{name}.png.
+                    - Wait until all unique characters are generated before proceeding.
+                4. Generate Scenes
+                    - For each storyboard page (1-6):
+                        - Construct a requirements string combining the background, narration context, and character placements.
+                        - Call scene_creator with:
+                            - requirements (scene description with characters, background, narration guidance)
+                            - scene_index (page number 1-6)
+                            - images (list of character base image filenames).
+                            - output_directory (temp_dir)
+                        - Store final scene image in {temp_dir}/scene_{scene_index}.png.
+                    - Wait until all 6 scenes are generated before proceeding.
+                5. Add Narration to Scenes
+                    - For each generated scene:
+                        - Call narration_writer with:
+                            - scene_index (page number)
+                            - narration (text from the storyboard for that page)
+                            - output_directory (temp_dir)
+                        - Store the final scene with narration in {temp_dir}/scene_{scene_index}_narrated.png.
+                    - Wait until this step is fully completed before proceeding.
+                        
+                6. Return the string "all done" once all of steps 1-5 are fully completed.
+
+                # Constraints
+                1. Always generate exactly 6 pages. Do not output fewer or more.
+                2. Always ensure character consistency across all pages by reusing their base images.
+                3. Narration should be short, simple, and engaging for children.
+                4. Scenes must clearly reflect narration and emotional tone.
+                5. If ambiguity arises in user prompt, make reasonable assumptions and proceed.
+                6. You must keep calling tools until the final illustrated book is ready. Do not ask the user anything in between.
+                7. You must follow your workflow sequentially from 1-6 and not skip steps.
+                """ + 
+                f"""
+                # Constants
+                1. temp_dir = {temp_dir}
+                """,
+                )
+            
+            mcp_tools = mcp_session.tools
+            print(f"Available tools: {[tool.tool_name for tool in mcp_tools]}")
+            
+            agent.tool_registry.process_tools(mcp_tools)
+            
+            result = agent(user_input)
+            
+            print("last response: " + result.__str__())
+            # the agent sometimes stops early; nudge it a bounded number of times instead of waiting on stdin
+            for _ in range(AGENT_MAX_CONTINUES):
+                if "all done" in result.__str__().lower() and not missing_pages(temp_dir):
+                    break
+                print("Continuing agent tasks...")
+                result = agent("Continue the workflow from where you stopped until every page has its narration, then reply \"all done\".")
+            missing = missing_pages(temp_dir)
+            if missing:
+                raise RuntimeError(f"Agent did not finish pages {missing}")
+            print("Agent finished all tasks.")
+            
+            return compile_pdf(temp_dir)
                 
-                # compile pdf
-                in_dir = temp_dir + "/"
-                pages = [Image.open(f"{in_dir}scene_{index}_narrated.png") for index in range(1, 7)]
-                with tempfile.NamedTemporaryFile(mode="wb", dir=in_dir) as temp_pdf:        
-                    pages[0].save(
-                        temp_pdf.name, "PDF" ,resolution=100.0, save_all=True, append_images=pages[1:]
-                    )
-                    return open(temp_pdf.name, "rb").read()
-                    
-        except Exception as e:
-            print("SERVER CONNECTION FAILED: " + str(e.with_traceback(None)))
-            
\ No newline at end of file
+    except Exception as e:
+        print("AGENT RUN FAILED: " + str(e.with_traceback(None)))
+        
\ No newline at end of file
@@ -0,0 +1,69 @@
+import time
+import zipfile
+
+
+class _ChunkBuffer:
+    """
+    Write-only file object that hands everything written so far to the caller on drain().
+    It has no tell()/seek(), so zipfile writes entries with data descriptors and never goes back.
+    """
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data) -> int:
+        if data:
+            self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _pending(buffer: _ChunkBuffer):
+    data = buffer.drain()
+    if data:
+        yield data
+
+
+def stream_zip(entries, failed: list = None):
+    """
+    Purpose: Builds a zip archive while it is being sent
+    Input: entries is an iterable of (file name, iterable of bytes chunks); chunks are consumed one at a time.
+           When `failed` is given, an entry whose chunks raise does not end the archive: the entry is left out
+           if nothing of it was read yet, or ends where the error occurred, and (name, error, written) is appended
+           to `failed`, so a later entry (eg. an index) can list it. Without it the error propagates.
+    Output: generator of archive bytes; at most about one chunk of each entry is held in memory.
+            Entries are stored without compression, which suits PDFs whose images are already compressed.
+    """
+    buffer = _ChunkBuffer()
+    with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_STORED) as archive:
+        for name, chunks in entries:
+            chunks = iter(chunks)
+            try:
+                # the entry's header is only written once its source has answered
+                chunk = next(chunks, None)
+            except Exception as e:
+                if failed is None:
+                    raise
+                failed.append((name, e, False))
+                continue
+            info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+            with archive.open(info, "w", force_zip64=True) as entry:
+                while chunk is not None:
+                    entry.write(chunk)
+                    yield from _pending(buffer)
+                    try:
+                        chunk = next(chunks, None)
+                    except Exception as e:
+                        if failed is None:
+                            raise
+                        failed.append((name, e, True))
+                        break
+            yield from _pending(buffer)
+    yield from _pending(buffer)
@@ -0,0 +1,101 @@
+import os
+import threading
+import time
+
+import jwt
+from cachetools import TTLCache
+
+CACHE_SIZE = int(os.environ.get("AUTH_CACHE_SIZE", "1024"))
+CACHE_TTL = float(os.environ.get("AUTH_CACHE_TTL", "300"))
+AUDIENCE = "authenticated"
+
+
+class AuthUser:
+    """
+    The parts of a Supabase user the routes rely on, built from verified token claims.
+    """
+
+    def __init__(self, id: str, email: str = None):
+        self.id = id
+        self.email = email
+
+
+class UnknownKey(Exception):
+    pass
+
+
+class TokenVerifier:
+    """
+    Verifies Supabase access tokens locally and remembers the result.
+    HS256 tokens are checked against the project JWT secret; asymmetric tokens against the project JWKS,
+    which is fetched once and cached. Only when neither can check a token (no secret configured, unknown key id,
+    missing crypto backend) does it fall back to `remote_get_user(token)`, ie. supabase.auth.get_user.
+    Verified tokens are cached until CACHE_TTL seconds pass or the token expires, whichever comes first.
+    """
+
+    def __init__(self, remote_get_user, jwt_secret: str = None, jwks_url: str = None,
+                 cache_size: int = CACHE_SIZE, cache_ttl: float = CACHE_TTL):
+        self.remote_get_user = remote_get_user
+        self.jwt_secret = jwt_secret
+        self.jwks = jwt.PyJWKClient(jwks_url, cache_keys=True) if jwks_url else None
+        self.hits = 0
+        self.misses = 0
+        self._cache = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+        self._lock = threading.Lock()
+
+    def _signing_key(self, token: str, algorithm: str):
+        # returns the key and the one algorithm it may be used with; the header only picks which key to look up,
+        # it never chooses the algorithm the signature is checked with
+        if algorithm == "HS256":
+            if not self.jwt_secret:
+                raise UnknownKey("no JWT secret configured")
+            return self.jwt_secret, "HS256"
+        if not self.jwks:
+            raise UnknownKey("no JWKS configured")
+        try:
+            signing_key = self.jwks.get_signing_key_from_jwt(token)
+        except jwt.PyJWTError as e:
+            raise UnknownKey(str(e))
+        return signing_key.key, signing_key.algorithm_name
+
+    def _verify_locally(self, token: str):
+        key, algorithm = self._signing_key(token, jwt.get_unverified_header(token).get("alg"))
+        claims = jwt.decode(token, key, algorithms=[algorithm], audience=AUDIENCE)
+        return AuthUser(claims["sub"], claims.get("email")), claims["exp"]
+
+    def verify(self, token: str):
+        """
+        Purpose: Resolves an access token to its user
+        Input: token is the bearer access token
+        Output: the user (AuthUser, or the Supabase user on the remote path), or None if the token is invalid or expired
+        """
+        now = time.time()
+        with self._lock:
+            cached = self._cache.get(token)
+            if cached and cached[1] > now:
+                self.hits += 1
+                return cached[0]
+            self.misses += 1
+
+        try:
+            user, expires_at = self._verify_locally(token)
+        except (UnknownKey, NotImplementedError, jwt.InvalidAlgorithmError) as e:
+            print("Verifying token remotely: " + str(e))
+            user = self.remote_get_user(token).user
+            if not user:
+                return None
+            try:
+                expires_at = jwt.decode(token, options={"verify_signature": False})["exp"]
+            except (jwt.PyJWTError, KeyError):
+                expires_at = now + CACHE_TTL
+        except jwt.PyJWTError:
+            # bad signature, expired, wrong audience, malformed
+            return None
+
+        with self._lock:
+            self._cache[token] = (user, expires_at)
+        return user
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._cache)}
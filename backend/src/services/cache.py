@@ -0,0 +1,159 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+
+from cachetools import TTLCache
+
+
+def normalize(text: str) -> str:
+    return " ".join(str(text).lower().split())
+
+
+def _replace_with(destination: str, write):
+    # write(file) fills a temporary file next to `destination`, which then replaces it in one step,
+    # so a crash never leaves a partial file under the final name
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(destination) or ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+        os.replace(temp_path, destination)
+    except BaseException:
+        _discard(temp_path)
+        raise
+
+
+def _discard(path: str):
+    # cleanup on an error path; failing here must not hide the error being handled
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def write_atomic(destination: str, data: bytes):
+    _replace_with(destination, lambda f: f.write(data))
+
+
+def copy_atomic(source: str, destination: str):
+    with open(source, "rb") as src:
+        _replace_with(destination, lambda f: shutil.copyfileobj(src, f))
+
+
+def link_atomic(source: str, destination: str):
+    """
+    Makes `destination` the same file as `source`: a hard link when both are on the same file system,
+    a copy otherwise. Like write_atomic, the final name only ever refers to a complete file.
+    """
+    temp_path = f"{destination}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        os.link(source, temp_path)
+    except OSError:
+        copy_atomic(source, destination)
+        return
+    try:
+        os.replace(temp_path, destination)
+    except BaseException:
+        _discard(temp_path)
+        raise
+
+
+class DiskCache:
+    """
+    Content-addressed file cache. Entries are stored as "{directory}/{sha256}{suffix}" and evicted
+    least recently used first once the directory grows past `max_bytes`.
+    Writes go through a temporary file and os.replace, so several processes can share one directory.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, suffix: str = ""):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(*parts) -> str:
+        """
+        Hashes the normalized (lower case, collapsed whitespace) parts into a cache key.
+        """
+        return hashlib.sha256("\x1f".join(normalize(part) for part in parts).encode("utf-8")).hexdigest()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key + self.suffix)
+
+    def get(self, key: str, destination: str) -> bool:
+        """
+        Copies the cached entry to `destination`; returns False on a miss.
+        """
+        path = self.path(key)
+        try:
+            copy_atomic(path, destination)
+            os.utime(path)  # mark as recently used
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return False
+        with self._lock:
+            self.hits += 1
+        return True
+
+    def put(self, key: str, source: str):
+        """
+        Stores a copy of the file at `source` under `key`, then evicts old entries if needed.
+        """
+        copy_atomic(source, self.path(key))
+        self.evict()
+
+    def evict(self):
+        entries = []
+        total = 0
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith(".tmp") or not entry.is_file():
+                    continue
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+
+class UserCache:
+    """
+    Short-lived in-process cache of per-user responses, dropped as a whole when that user's data changes.
+    Other worker processes keep their copy until it expires, so `ttl` bounds how stale a response can be.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self._entries = TTLCache(maxsize=maxsize, ttl=ttl)  # user_id -> {key: value}
+        self._lock = threading.Lock()
+
+    def get(self, user_id: str, key):
+        with self._lock:
+            return self._entries.get(user_id, {}).get(key)
+
+    def put(self, user_id: str, key, value):
+        with self._lock:
+            entries = self._entries.get(user_id)
+            if entries is None:
+                entries = self._entries[user_id] = {}
+            entries[key] = value
+
+    def invalidate(self, user_id: str):
+        with self._lock:
+            self._entries.pop(user_id, None)
@@ -0,0 +1,109 @@
+import os
+import threading
+
+import httpx
+
+# image calls routinely take tens of seconds, so the read timeout is generous; connecting should be quick
+TIMEOUT = float(os.environ.get("HTTP_TIMEOUT", "180"))
+CONNECT_TIMEOUT = float(os.environ.get("HTTP_CONNECT_TIMEOUT", "10"))
+MAX_CONNECTIONS = int(os.environ.get("HTTP_MAX_CONNECTIONS", "20"))
+MAX_KEEPALIVE = int(os.environ.get("HTTP_MAX_KEEPALIVE", "10"))
+KEEPALIVE_EXPIRY = float(os.environ.get("HTTP_KEEPALIVE_EXPIRY", "120"))
+SUPABASE_PROVIDER = os.environ.get("SUPABASE_PROVIDER", "live")  # "live" or "fake" (in memory, see fakesupabase.py)
+
+
+def _http2_available() -> bool:
+    if os.environ.get("HTTP2", "1") != "1":
+        return False
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+HTTP2 = _http2_available()
+
+_clients = {}
+_lock = threading.RLock()  # factories may build other shared clients
+
+
+def _shared(name: str, factory):
+    # one client per process; httpx, OpenAI and genai clients are safe to share between threads
+    with _lock:
+        if name not in _clients:
+            _clients[name] = factory()
+        return _clients[name]
+
+
+def limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=MAX_CONNECTIONS,
+        max_keepalive_connections=MAX_KEEPALIVE,
+        keepalive_expiry=KEEPALIVE_EXPIRY,
+    )
+
+
+def timeout() -> httpx.Timeout:
+    return httpx.Timeout(TIMEOUT, connect=CONNECT_TIMEOUT)
+
+
+def http_client() -> httpx.Client:
+    """
+    Plain pooled HTTP client, eg. for streaming objects out of Supabase storage.
+    """
+    def create():
+        if SUPABASE_PROVIDER == "fake":
+            from .fakesupabase import storage_transport
+            return httpx.Client(transport=storage_transport(supabase_client()), timeout=timeout())
+        return httpx.Client(timeout=timeout(), limits=limits(), http2=HTTP2)
+    return _shared("http", create)
+
+
+def openai_client():
+    def create():
+        from openai import OpenAI, DefaultHttpxClient
+        return OpenAI(
+            api_key=os.environ.get("OPENAI_API_KEY"),
+            max_retries=0,  # retries, backoff and hedging happen in resilience.call
+            http_client=DefaultHttpxClient(timeout=timeout(), limits=limits(), http2=HTTP2),
+        )
+    return _shared("openai", create)
+
+
+def genai_client():
+    def create():
+        from google import genai
+        from google.genai.types import HttpOptions
+        return genai.Client(
+            http_options=HttpOptions(
+                api_version="v1",
+                timeout=int(TIMEOUT * 1000),  # milliseconds
+                client_args={"limits": limits(), "http2": HTTP2},
+            ),
+            vertexai=os.environ.get("GOOGLE_GENAI_USE_VERTEXAI"),
+            project=os.environ.get("GOOGLE_CLOUD_PROJECT"),
+            location=os.environ.get("GOOGLE_CLOUD_LOCATION"),
+        )
+    return _shared("genai", create)
+
+
+def supabase_client():
+    """
+    Service-role Supabase client. supabase-py keeps one HTTP/2 connection pool per sub-client (postgrest, storage, auth);
+    a shared httpx_client is deliberately not passed in, because each sub-client overwrites its base_url.
+    """
+    def create():
+        if SUPABASE_PROVIDER == "fake":
+            from .fakesupabase import FakeSupabase
+            return FakeSupabase()
+        from supabase import create_client, ClientOptions
+        return create_client(
+            os.environ.get("SUPABASE_URL"),
+            os.environ.get("SUPABASE_SECRET_KEY"),
+            options=ClientOptions(
+                postgrest_client_timeout=timeout(),
+                storage_client_timeout=int(TIMEOUT),
+            ),
+        )
+    return _shared("supabase", create)
@@ -0,0 +1,283 @@
+import datetime
+import hashlib
+import os
+import re
+import threading
+import time
+import types
+import uuid
+from urllib.parse import unquote
+
+import httpx
+import jwt
+
+# PostgREST filter terms as used in or_(): column.operator."value" and nested and(...)/or(...) groups
+TERM = re.compile(r'(\w+)\.(eq|neq|lt|lte|gt|gte)\.("(?:[^"\\]|\\.)*"|[^,()]*)')
+OPERATORS = {
+    "eq": lambda a, b: a == b,
+    "neq": lambda a, b: a != b,
+    "lt": lambda a, b: a < b,
+    "lte": lambda a, b: a <= b,
+    "gt": lambda a, b: a > b,
+    "gte": lambda a, b: a >= b,
+}
+
+
+def _parse_group(text: str, position: int = 0):
+    # returns ([conditions], position after the group); a condition is a predicate on a row
+    conditions = []
+    while position < len(text) and text[position] != ")":
+        if text[position] == ",":
+            position += 1
+            continue
+        group = re.match(r"(and|or)\(", text[position:])
+        if group:
+            inner, position = _parse_group(text, position + group.end())
+            position += 1  # closing parenthesis
+            combine = all if group.group(1) == "and" else any
+            conditions.append(lambda row, inner=inner, combine=combine: combine(condition(row) for condition in inner))
+            continue
+        term = TERM.match(text, position)
+        if not term:
+            raise ValueError(f"Unsupported filter: {text[position:]}")
+        column, operator, value = term.groups()
+        value = value[1:-1] if value.startswith('"') else value
+        conditions.append(lambda row, column=column, operator=operator, value=value: OPERATORS[operator](str(row.get(column)), value))
+        position = term.end()
+    return conditions, position
+
+
+class FakeQuery:
+    def __init__(self, database, table: str):
+        self.database = database
+        self.table = table
+        self.operation = "select"
+        self.payload = None
+        self.filters = []
+        self.ordering = []
+        self.row_limit = None
+        self.row_offset = 0
+        self.single = False
+
+    def select(self, *columns, **options):
+        return self
+
+    def insert(self, payload):
+        self.operation, self.payload = "insert", payload
+        return self
+
+    def update(self, payload):
+        self.operation, self.payload = "update", payload
+        return self
+
+    def delete(self):
+        self.operation = "delete"
+        return self
+
+    def eq(self, column, value):
+        self.filters.append(lambda row: row.get(column) == value)
+        return self
+
+    def in_(self, column, values):
+        values = list(values)
+        self.filters.append(lambda row: row.get(column) in values)
+        return self
+
+    def or_(self, expression: str):
+        conditions, _ = _parse_group(expression)
+        self.filters.append(lambda row: any(condition(row) for condition in conditions))
+        return self
+
+    def order(self, column, desc=False):
+        self.ordering.append((column, desc))
+        return self
+
+    def limit(self, count: int):
+        self.row_limit = count
+        return self
+
+    def range(self, start: int, end: int):
+        # both ends inclusive, like PostgREST
+        self.row_offset, self.row_limit = start, end - start + 1
+        return self
+
+    def maybe_single(self):
+        self.single = True
+        return self
+
+    def execute(self):
+        with self.database.lock:
+            rows = self.database.tables.setdefault(self.table, [])
+            if self.operation == "insert":
+                payloads = self.payload if isinstance(self.payload, list) else [self.payload]
+                inserted = []
+                for payload in payloads:
+                    row = {"id": str(uuid.uuid4()), "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat()}
+                    row.update(payload)
+                    rows.append(row)
+                    inserted.append(dict(row))
+                return types.SimpleNamespace(data=inserted)
+
+            matched = [row for row in rows if all(condition(row) for condition in self.filters)]
+            if self.operation == "update":
+                for row in matched:
+                    row.update(self.payload)
+                return types.SimpleNamespace(data=[dict(row) for row in matched])
+            if self.operation == "delete":
+                for row in matched:
+                    rows.remove(row)
+                return types.SimpleNamespace(data=[dict(row) for row in matched])
+
+            for column, desc in reversed(self.ordering):
+                matched.sort(key=lambda row: row.get(column), reverse=desc)
+            matched = matched[self.row_offset:]
+            if self.row_limit is not None:
+                matched = matched[:self.row_limit]
+            matched = [dict(row) for row in matched]
+            if self.single:
+                # maybe_single() returns None instead of a response when nothing matched
+                return types.SimpleNamespace(data=matched[0]) if matched else None
+            return types.SimpleNamespace(data=matched)
+
+
+class FakeBucket:
+    def __init__(self, storage, name: str):
+        self.storage = storage
+        self.name = name
+
+    def create_signed_upload_url(self, path: str) -> dict:
+        return {"signed_url": f"/object/upload/sign/{self.name}/{path}", "token": uuid.uuid4().hex, "path": path}
+
+    def upload_to_signed_url(self, path: str, token: str, file: bytes, file_options: dict = None):
+        with self.storage.lock:
+            if (self.name, path) in self.storage.objects:
+                raise ValueError(f"The resource already exists: {path}")
+            self.storage.objects[(self.name, path)] = bytes(file)
+        return types.SimpleNamespace(path=path, full_path=f"{self.name}/{path}")
+
+    def update(self, path: str, file: bytes, file_options: dict = None):
+        with self.storage.lock:
+            self.storage.objects[(self.name, path)] = bytes(file)
+        return types.SimpleNamespace(path=path, full_path=f"{self.name}/{path}")
+
+    def download(self, path: str) -> bytes:
+        with self.storage.lock:
+            return self.storage.objects[(self.name, path)]
+
+    def remove(self, paths: list) -> list:
+        removed = []
+        with self.storage.lock:
+            for path in paths:
+                if self.storage.objects.pop((self.name, path), None) is not None:
+                    removed.append({"name": path, "bucket_id": self.name})
+        return removed
+
+
+class FakeStorage:
+    def __init__(self):
+        self.objects = {}  # (bucket, path) -> bytes
+        self.lock = threading.Lock()
+
+    def from_(self, bucket: str) -> FakeBucket:
+        return FakeBucket(self, bucket)
+
+
+class FakeAuth:
+    """
+    Accounts kept in memory. Sessions are HS256 tokens signed with SUPABASE_JWT_SECRET,
+    so the API verifies them locally exactly like real Supabase tokens.
+    """
+
+    def __init__(self, secret: str):
+        self.secret = secret
+        self.users = {}  # email -> (user, password)
+        self.lock = threading.Lock()
+
+    def token(self, user) -> str:
+        claims = {"sub": user.id, "email": user.email, "aud": "authenticated", "exp": int(time.time()) + 3600}
+        return jwt.encode(claims, self.secret, algorithm="HS256")
+
+    def sign_up(self, credentials: dict):
+        user = types.SimpleNamespace(id=str(uuid.uuid4()), email=credentials["email"])
+        with self.lock:
+            if credentials["email"] in self.users:
+                raise ValueError("User already registered")
+            self.users[credentials["email"]] = (user, credentials["password"])
+        return types.SimpleNamespace(user=user, session=None)
+
+    def sign_in_with_password(self, credentials: dict):
+        with self.lock:
+            user, password = self.users.get(credentials["email"], (None, None))
+        if not user or password != credentials["password"]:
+            raise ValueError("Invalid login credentials")
+        session = types.SimpleNamespace(access_token=self.token(user), refresh_token=uuid.uuid4().hex)
+        return types.SimpleNamespace(user=user, session=session)
+
+    def get_user(self, token: str):
+        try:
+            claims = jwt.decode(token, self.secret, algorithms=["HS256"], audience="authenticated")
+        except jwt.PyJWTError:
+            return types.SimpleNamespace(user=None)
+        return types.SimpleNamespace(user=types.SimpleNamespace(id=claims["sub"], email=claims.get("email")))
+
+    def reset_password_email(self, email: str):
+        pass
+
+    def verify_otp(self, params: dict):
+        raise ValueError("OTP verification is not available offline")
+
+    def update_user(self, attributes: dict):
+        raise ValueError("Not signed in")
+
+    def sign_out(self):
+        pass
+
+
+class FakeSupabase:
+    """
+    In-memory stand-in for the parts of the Supabase client the API uses (tables, storage, auth),
+    for benchmarks and offline runs. Selected with SUPABASE_PROVIDER=fake.
+    """
+
+    def __init__(self, secret: str = None):
+        self.tables = {}
+        self.lock = threading.Lock()
+        self.storage = FakeStorage()
+        self.auth = FakeAuth(secret or os.environ.get("SUPABASE_JWT_SECRET") or "offline-secret")
+
+    def table(self, name: str) -> FakeQuery:
+        return FakeQuery(self, name)
+
+
+def storage_transport(supabase: FakeSupabase) -> httpx.MockTransport:
+    """
+    Serves GET {url}/storage/v1/object/{bucket}/{path} from the fake storage, with ETag and single-range support.
+    """
+    def handle(request: httpx.Request) -> httpx.Response:
+        match = re.match(r"/storage/v1/object/([^/]+)/(.+)", request.url.path)
+        if request.method != "GET" or not match:
+            return httpx.Response(404)
+        bucket, path = match.group(1), unquote(match.group(2))
+        with supabase.storage.lock:
+            data = supabase.storage.objects.get((bucket, path))
+        if data is None:
+            return httpx.Response(400, json={"error": "not_found"})
+
+        etag = '"' + hashlib.md5(data).hexdigest() + '"'
+        headers = {"ETag": etag, "Accept-Ranges": "bytes"}
+        if request.headers.get("If-None-Match") == etag:
+            return httpx.Response(304, headers=headers)
+        byte_range = re.match(r"bytes=(\d*)-(\d*)$", request.headers.get("Range", ""))
+        if byte_range and any(byte_range.groups()):
+            start, end = byte_range.groups()
+            if start:
+                start, end = int(start), min(int(end) if end else len(data) - 1, len(data) - 1)
+            else:
+                start, end = max(len(data) - int(end), 0), len(data) - 1
+            if start > end:
+                return httpx.Response(416, headers={"Content-Range": f"bytes */{len(data)}"})
+            headers["Content-Range"] = f"bytes {start}-{end}/{len(data)}"
+            return httpx.Response(206, content=data[start:end + 1], headers=headers)
+        return httpx.Response(200, content=data, headers=headers)
+
+    return httpx.MockTransport(handle)
@@ -0,0 +1,462 @@
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+
+from . import memory, telemetry
+from .cache import write_atomic
+
+JOBS_DIR = os.environ.get("JOBS_DIR", os.path.join(tempfile.gettempdir(), "storybooker_jobs"))
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "2"))
+POLL_INTERVAL = float(os.environ.get("JOB_POLL_INTERVAL", "1.0"))
+# finished jobs, their events and result files are deleted after this long (as long as runs are kept, by default)
+JOB_RETENTION = float(os.environ.get("JOB_RETENTION", str(7 * 24 * 3600)))
+PRUNE_INTERVAL = 3600
+# a job whose worker process died is queued again this many times before it is failed
+JOB_MAX_RECOVERIES = int(os.environ.get("JOB_MAX_RECOVERIES", "2"))
+
+QUEUED = "queued"
+RUNNING = "running"
+LOST = "lost"
+DONE = "done"
+FAILED = "failed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    status TEXT NOT NULL,
+    title TEXT,
+    prompt TEXT,
+    error TEXT,
+    result_path TEXT,
+    batch_id TEXT,
+    memory_bytes INTEGER,
+    peak_bytes INTEGER,
+    worker_pid INTEGER,
+    worker_started TEXT,
+    created_at REAL NOT NULL,
+    queued_at REAL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS job_events (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id TEXT NOT NULL,
+    event TEXT NOT NULL,
+    data TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS job_events_job_id ON job_events (job_id, seq);
+"""
+# columns added after the first release, for databases created before them
+MIGRATIONS = (
+    ("batch_id", "ALTER TABLE jobs ADD COLUMN batch_id TEXT"),
+    ("memory_bytes", "ALTER TABLE jobs ADD COLUMN memory_bytes INTEGER"),
+    ("peak_bytes", "ALTER TABLE jobs ADD COLUMN peak_bytes INTEGER"),
+    ("worker_pid", "ALTER TABLE jobs ADD COLUMN worker_pid INTEGER"),
+    ("worker_started", "ALTER TABLE jobs ADD COLUMN worker_started TEXT"),
+    ("queued_at", "ALTER TABLE jobs ADD COLUMN queued_at REAL; UPDATE jobs SET queued_at = created_at"),
+)
+# finished books whose measured peak sets the memory estimate of the next one
+MEMORY_SAMPLE_JOBS = 20
+
+
+class JobQueue:
+    """
+    SQLite-backed queue of storybook generation jobs with a pool of background worker threads.
+    The database lives on local disk so every gunicorn worker process on the machine shares the same jobs;
+    each process runs its own `workers` threads, and a job is claimed by exactly one of them.
+    Machines do not share it: the app runs as a single machine, with `jobs_dir` on a disk that survives restarts
+    (see fly.toml), or jobs would be lost on restart and looked up on machines that never had them.
+    `handler(job, emit)` does the actual work and returns the PDF bytes, which are kept in `jobs_dir`;
+    it reports progress with `emit(event, data)`, and those events are stored so any process can stream them.
+    Jobs submitted together with submit_batch are claimed together and passed to `batch_handler(jobs, emit)`,
+    which reports progress with `emit(job_id, event, data)` and returns the PDF bytes or the exception of each job;
+    a job of a batch that is queued again on its own (eg. a retry) goes to `handler` like any other.
+    Jobs are admitted against `memory_budget`, shared by every process using the database: a queued job waits
+    while the estimated memory of the running jobs plus its own would exceed it (see _claim and memory.py).
+    """
+
+    def __init__(self, handler, jobs_dir: str = JOBS_DIR, workers: int = JOB_WORKERS, poll_interval: float = POLL_INTERVAL,
+                 batch_handler=None, memory_budget: int = None, on_abandon=None, retention: float = JOB_RETENTION):
+        self.handler = handler
+        self.on_abandon = on_abandon
+        self.retention = retention
+        self._pruned_at = 0
+        self.memory_budget = memory.memory_budget() if memory_budget is None else memory_budget
+        self.batch_handler = batch_handler
+        self.jobs_dir = jobs_dir
+        self.workers = workers
+        self.poll_interval = poll_interval
+        os.makedirs(jobs_dir, exist_ok=True)
+        self.db_path = os.path.join(jobs_dir, "jobs.sqlite3")
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript(SCHEMA)
+            columns = {row["name"] for row in db.execute("PRAGMA table_info(jobs)")}
+            for column, statement in MIGRATIONS:
+                if column not in columns:
+                    db.executescript(statement)
+        self._wakeup = threading.Event()
+        self._threads = []
+        self._start_lock = threading.Lock()
+
+    def _connect(self):
+        db = sqlite3.connect(self.db_path, timeout=30)
+        db.row_factory = sqlite3.Row
+        return db
+
+    def start(self):
+        # called from create_app, which gunicorn runs in every worker process (not in the master, there is no --preload),
+        # and again on submit in case the app was created elsewhere
+        with self._start_lock:
+            if self._threads:
+                return
+            for index in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f"job-worker-{index}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, user_id: str, title: str, prompt: str) -> str:
+        self.start()
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._connect() as db:
+            db.execute(
+                "INSERT INTO jobs (id, user_id, status, title, prompt, created_at, queued_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, user_id, QUEUED, title, prompt, now, now, now),
+            )
+        self._wakeup.set()
+        return job_id
+
+    def submit_batch(self, user_id: str, books: list) -> tuple:
+        """
+        Queues one job per (title, prompt) in `books`, all in one transaction and under a common batch ID.
+        Returns the batch ID and the job IDs in the order of `books`.
+        """
+        self.start()
+        batch_id = uuid.uuid4().hex
+        job_ids = [uuid.uuid4().hex for _ in books]
+        now = time.time()
+        with self._connect() as db:
+            db.executemany(
+                "INSERT INTO jobs (id, user_id, status, title, prompt, batch_id, created_at, queued_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(job_id, user_id, QUEUED, title, prompt, batch_id, now, now, now) for job_id, (title, prompt) in zip(job_ids, books)],
+            )
+        self._wakeup.set()
+        return batch_id, job_ids
+
+    def batch(self, batch_id: str) -> list:
+        with self._connect() as db:
+            rows = db.execute("SELECT * FROM jobs WHERE batch_id = ? ORDER BY rowid", (batch_id,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def get(self, job_id: str) -> dict:
+        with self._connect() as db:
+            row = db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def result(self, job_id: str) -> bytes:
+        job = self.get(job_id)
+        if not job or job["status"] != DONE:
+            return None
+        with open(job["result_path"], "rb") as f:
+            return f.read()
+
+    def requeue(self, job_id: str, status: str) -> int:
+        """
+        Puts a finished job back in the queue if it is still in `status` (DONE or FAILED), eg. to resume it.
+        Returns the sequence number of the "queued" event, so clients can follow only the new run's events,
+        or None if the job was not in that state.
+        """
+        now = time.time()
+        with self._connect() as db:
+            # it waits behind the jobs queued before it now, not before it was first created
+            requeued = db.execute(
+                "UPDATE jobs SET status = ?, error = NULL, queued_at = ?, updated_at = ? WHERE id = ? AND status = ?",
+                (QUEUED, now, now, job_id, status),
+            ).rowcount
+        if not requeued:
+            return None
+        seq = self.emit(job_id, QUEUED, {})
+        self.start()
+        self._wakeup.set()
+        return seq
+
+    def emit(self, job_id: str, event: str, data: dict) -> int:
+        with self._connect() as db:
+            return db.execute(
+                "INSERT INTO job_events (job_id, event, data, created_at) VALUES (?, ?, ?, ?)",
+                (job_id, event, json.dumps(data), time.time()),
+            ).lastrowid
+
+    def events(self, job_id: str, after: int = 0) -> list:
+        """
+        Returns the events of a job with a sequence number greater than `after`, oldest first.
+        """
+        with self._connect() as db:
+            rows = db.execute(
+                "SELECT seq, event, data, created_at FROM job_events WHERE job_id = ? AND seq > ? ORDER BY seq",
+                (job_id, after),
+            ).fetchall()
+        return [{"seq": row["seq"], "event": row["event"], "data": json.loads(row["data"]), "created_at": row["created_at"]} for row in rows]
+
+    def memory_estimate(self) -> int:
+        """
+        Bytes reserved for the next book admitted, following the peaks of the books finished last.
+        """
+        with self._connect() as db:
+            return self._estimate(db)
+
+    def peak_bytes(self) -> list:
+        """
+        Returns the accounted memory peak of every finished job that recorded one.
+        """
+        with self._connect() as db:
+            rows = db.execute("SELECT peak_bytes FROM jobs WHERE status = ? AND peak_bytes IS NOT NULL", (DONE,)).fetchall()
+        return [row["peak_bytes"] for row in rows]
+
+    def _claim(self) -> list:
+        """
+        Claims the oldest queued job, together with the other queued jobs of its batch if it has one,
+        provided the memory they are estimated to need fits in the budget next to the jobs already running.
+        """
+        with self._connect() as db:
+            while True:
+                # the write lock is taken before reading, so two workers never admit against the same free memory
+                db.execute("BEGIN IMMEDIATE")
+                row = db.execute(
+                    "SELECT id, batch_id FROM jobs WHERE status = ? ORDER BY queued_at LIMIT 1", (QUEUED,)
+                ).fetchone()
+                if not row:
+                    db.rollback()
+                    return []
+                now = time.time()
+                if row["batch_id"] and self.batch_handler:
+                    ids = [batch_row["id"] for batch_row in db.execute(
+                        "SELECT id FROM jobs WHERE batch_id = ? AND status = ? ORDER BY rowid", (row["batch_id"], QUEUED))]
+                else:
+                    ids = [row["id"]]
+                estimate = self._estimate(db)
+                if not self._admit(db, estimate * len(ids)):
+                    db.rollback()
+                    return []
+                claimed = [job_id for job_id in ids if db.execute(
+                    "UPDATE jobs SET status = ?, memory_bytes = ?, worker_pid = ?, worker_started = ?, updated_at = ? "
+                    "WHERE id = ? AND status = ?",
+                    (RUNNING, estimate, os.getpid(), _started(os.getpid()), now, job_id, QUEUED),
+                ).rowcount]
+                db.commit()
+                if claimed:
+                    return [dict(db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()) for job_id in claimed]
+
+    def _estimate(self, db) -> int:
+        # the largest peak of the last books made on this machine, so the estimate follows what books really take
+        row = db.execute(
+            "SELECT MAX(peak_bytes) FROM (SELECT peak_bytes FROM jobs WHERE status = ? AND peak_bytes IS NOT NULL "
+            "ORDER BY updated_at DESC LIMIT ?)", (DONE, MEMORY_SAMPLE_JOBS),
+        ).fetchone()
+        return memory.job_estimate(row[0])
+
+    def _admit(self, db, needed: int) -> bool:
+        """
+        Whether `needed` bytes fit next to the memory reserved by running jobs. Jobs of processes that are gone
+        (eg. killed for running out of memory) hold nothing, and a job always runs when nothing else does,
+        even if it is estimated to need more than the whole budget.
+        """
+        if self.memory_budget <= 0:
+            return True
+        in_use = sum(row["memory_bytes"] for row in db.execute(
+            "SELECT memory_bytes, worker_pid, worker_started FROM jobs WHERE status = ? AND memory_bytes IS NOT NULL", (RUNNING,)
+        ) if _alive(row["worker_pid"], row["worker_started"]))
+        telemetry.memory_admitted_bytes.set(in_use)
+        if in_use and in_use + needed > self.memory_budget:
+            telemetry.admission_deferred.inc()
+            return False
+        return True
+
+    def _finish(self, job_id: str, status: str, error: str = None, result_path: str = None, peak_bytes: int = None):
+        with self._connect() as db:
+            db.execute(
+                "UPDATE jobs SET status = ?, error = ?, result_path = ?, peak_bytes = COALESCE(?, peak_bytes), updated_at = ? WHERE id = ?",
+                (status, error, result_path, peak_bytes, time.time(), job_id),
+            )
+        # the memory of this job is free again; let the other workers of this process look at the queue
+        self._wakeup.set()
+
+    def _start_job(self, job: dict):
+        print(f"Job {job['id']} started")
+        telemetry.job_queue_seconds.observe(time.time() - job["queued_at"])
+        self.emit(job["id"], RUNNING, {})
+
+    def _complete(self, job: dict, pdf_bytes: bytes, peak_bytes: int = None):
+        result_path = os.path.join(self.jobs_dir, job["id"] + ".pdf")
+        # a rerun replaces the previous result, which may be being downloaded right now
+        write_atomic(result_path, pdf_bytes)
+        self._finish(job["id"], DONE, result_path=result_path, peak_bytes=peak_bytes)
+        self.emit(job["id"], DONE, {})
+        print(f"Job {job['id']} done")
+
+    def _fail(self, job: dict, error: Exception):
+        print(f"Job {job['id']} failed: " + str(error))
+        self._finish(job["id"], FAILED, error=str(error), result_path=job["result_path"])
+        self.emit(job["id"], FAILED, {"error": str(error)})
+
+    def _run(self, job: dict):
+        self._start_job(job)
+        try:
+            # root span of the job; every pipeline stage span nests under it
+            with memory.track() as meter:
+                with telemetry.stage("job", job_id=job["id"]):
+                    pdf_bytes = self.handler(job, lambda event, data: self.emit(job["id"], event, data))
+            self._complete(job, pdf_bytes, peak_bytes=meter.peak)
+        except Exception as e:
+            self._fail(job, e)
+
+    def _run_batch(self, jobs: list):
+        for job in jobs:
+            self._start_job(job)
+        with memory.track() as meter:
+            try:
+                with telemetry.stage("batch", batch_id=jobs[0]["batch_id"], jobs=len(jobs)):
+                    results = self.batch_handler(jobs, self.emit)
+            except Exception as e:
+                results = [e] * len(jobs)
+        for job, result in zip(jobs, results):
+            try:
+                if isinstance(result, Exception):
+                    raise result
+                # books of a batch share their buffers' peak
+                self._complete(job, result, peak_bytes=meter.peak // len(jobs))
+            except Exception as e:
+                self._fail(job, e)
+
+    def prune(self):
+        """
+        Deletes finished jobs that have not changed for longer than `retention` seconds, with their events and result files.
+        """
+        cutoff = time.time() - self.retention
+        with self._connect() as db:
+            rows = db.execute(
+                "SELECT id, result_path FROM jobs WHERE status IN (?, ?) AND updated_at < ?", (DONE, FAILED, cutoff)
+            ).fetchall()
+            for row in rows:
+                db.execute("DELETE FROM job_events WHERE job_id = ?", (row["id"],))
+                db.execute("DELETE FROM jobs WHERE id = ?", (row["id"],))
+        for row in rows:
+            if row["result_path"]:
+                try:
+                    os.remove(row["result_path"])
+                except FileNotFoundError:
+                    pass
+
+    def _recover(self):
+        """
+        Handles running jobs whose worker process is gone (eg. killed for running out of memory or at a redeploy):
+        they are queued again and resume from their checkpoints, or are failed and handed to `on_abandon`
+        (which refunds their generation) once they have been lost JOB_MAX_RECOVERIES times.
+        """
+        abandoned = []
+        with self._connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            lost = [dict(row) for row in db.execute(
+                "SELECT * FROM jobs WHERE status = ? AND worker_pid IS NOT NULL", (RUNNING,)
+            ) if not _alive(row["worker_pid"], row["worker_started"])]
+            now = time.time()
+            for job in lost:
+                recoveries = db.execute(
+                    "SELECT COUNT(*) FROM job_events WHERE job_id = ? AND event = ?", (job["id"], LOST)
+                ).fetchone()[0]
+                events = [(LOST, {"worker_pid": job["worker_pid"]})]
+                if recoveries < JOB_MAX_RECOVERIES:
+                    db.execute(
+                        "UPDATE jobs SET status = ?, memory_bytes = NULL, worker_pid = NULL, worker_started = NULL, "
+                        "queued_at = ?, updated_at = ? WHERE id = ?",
+                        (QUEUED, now, now, job["id"]),
+                    )
+                    events.append((QUEUED, {}))
+                    print(f"Job {job['id']} lost its worker, queued again")
+                else:
+                    error = "The worker running this job stopped"
+                    db.execute(
+                        "UPDATE jobs SET status = ?, error = ?, memory_bytes = NULL, updated_at = ? WHERE id = ?",
+                        (FAILED, error, now, job["id"]),
+                    )
+                    events.append((FAILED, {"error": error}))
+                    abandoned.append(job)
+                    print(f"Job {job['id']} failed: " + error)
+                db.executemany(
+                    "INSERT INTO job_events (job_id, event, data, created_at) VALUES (?, ?, ?, ?)",
+                    [(job["id"], event, json.dumps(data), now) for event, data in events],
+                )
+            db.commit()
+        for job in abandoned:
+            if self.on_abandon:
+                self.on_abandon(job)
+
+    def _housekeeping(self):
+        self._recover()
+        if time.time() - self._pruned_at > PRUNE_INTERVAL:
+            self._pruned_at = time.time()
+            self.prune()
+
+    def _work(self):
+        while True:
+            try:
+                self._housekeeping()
+            except Exception as e:
+                print("Job housekeeping failed: " + str(e))
+            jobs = self._claim()
+            if not jobs:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+            if len(jobs) > 1:
+                self._run_batch(jobs)
+            else:
+                self._run(jobs[0])
+
+
+def _boot_id() -> str:
+    try:
+        with open("/proc/sys/kernel/random/boot_id") as f:
+            return f.read().strip()
+    except OSError:
+        return ""
+
+
+BOOT_ID = _boot_id()
+
+
+def _started(pid: int) -> str:
+    """
+    When process `pid` started, as "<boot id>:<start time in clock ticks since boot>", or None when the process
+    does not exist or /proc is not available. Together with the PID it names one process: PIDs are reused,
+    in containers even from one boot to the next, but a reused PID starts at another time or in another boot.
+    """
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            # the command name (field 2) is in parentheses and may contain spaces; starttime is field 22
+            fields = f.read().rsplit(")", 1)[1].split()
+    except (OSError, IndexError):
+        return None
+    return f"{BOOT_ID}:{fields[19]}"
+
+
+def _alive(pid: int, started: str = None) -> bool:
+    if not pid:
+        return True
+    if started:
+        # with /proc the PID must also belong to the same process, not a later one that reused it
+        return _started(pid) == started
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
@@ -0,0 +1,121 @@
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+from strands.tools.mcp import MCPClient
+from mcp.client.stdio import stdio_client, StdioServerParameters
+
+POOL_SIZE = int(os.environ.get("MCP_POOL_SIZE", "2"))
+MAX_USES = int(os.environ.get("MCP_POOL_MAX_USES", "50"))
+MAX_AGE = float(os.environ.get("MCP_POOL_MAX_AGE", "3600"))
+
+# backend/ directory; the server is started as a module from here so it works both locally and in docker
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class MCPSession:
+    """
+    One running mcpserver subprocess with its tools already listed.
+    """
+
+    def __init__(self):
+        self.client = MCPClient(lambda: stdio_client(StdioServerParameters(
+            command=sys.executable,
+            args=["-m", "src.services.mcpserver"],
+            cwd=BACKEND_DIR,
+            env=dict(os.environ),
+        )))
+        self.client.start()
+        self.tools = self.client.list_tools_sync()
+        self.created = time.monotonic()
+        self.uses = 0
+
+    def expired(self, max_uses: int, max_age: float) -> bool:
+        return self.uses >= max_uses or time.monotonic() - self.created >= max_age
+
+    def healthy(self) -> bool:
+        try:
+            self.client.list_tools_sync()
+            return True
+        except Exception as e:
+            print("MCP session health check failed: " + str(e))
+            return False
+
+    def close(self):
+        try:
+            self.client.stop(None, None, None)
+        except Exception as e:
+            print("MCP session shutdown failed: " + str(e))
+
+
+class MCPPool:
+    """
+    Keeps up to `size` warm mcpserver sessions per worker process so the interpreter start,
+    heavy imports and API client setup are paid once instead of on every book.
+    Sessions are health checked before reuse and recycled after `max_uses` books or `max_age` seconds.
+    """
+
+    def __init__(self, size: int = POOL_SIZE, max_uses: int = MAX_USES, max_age: float = MAX_AGE):
+        self.size = size
+        self.max_uses = max_uses
+        self.max_age = max_age
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._idle = []
+
+    def _take_idle(self):
+        with self._lock:
+            return self._idle.pop() if self._idle else None
+
+    def _acquire(self) -> MCPSession:
+        session = self._take_idle()
+        while session is not None:
+            if not session.expired(self.max_uses, self.max_age) and session.healthy():
+                return session
+            session.close()
+            session = self._take_idle()
+        print("Starting MCP server session...")
+        return MCPSession()
+
+    def _release(self, session: MCPSession):
+        session.uses += 1
+        if session.expired(self.max_uses, self.max_age):
+            session.close()
+            return
+        with self._lock:
+            self._idle.append(session)
+
+    @contextmanager
+    def session(self):
+        """
+        Borrows a session for the duration of the block; blocks while all `size` sessions are in use.
+        """
+        self._slots.acquire()
+        try:
+            session = self._acquire()
+            try:
+                yield session
+            finally:
+                self._release(session)
+        finally:
+            self._slots.release()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for session in idle:
+            session.close()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> MCPPool:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = MCPPool()
+        return _pool
@@ -1,35 +1,82 @@
+import copy
 import os
+import sys
 import tempfile
-from mcp.server import FastMCP
-from openai import OpenAI
+import threading
 from dotenv import load_dotenv
 import json
 from PIL import Image
-from google import genai
-from google.genai.types import (
-    HttpOptions,
-)
 import base64
+import io
 import cv2
-import textwrap
-
-OPENAI_MODEL_ID = "gpt-4.1-nano" # "gpt-4.1"
-IMAGEN_MODEL_ID = "imagen-3.0-fast-generate-001" # "imagen-3.0-generate-002"
-PAGE_SIZE = "1024x1024"
+import numpy as np
+from cachetools import TTLCache
+from .cache import DiskCache, write_atomic
+from .runstore import character_key
+from . import memory, resilience, telemetry
+from .providers import model_provider
+from .textrender import overlay_text
 
 load_dotenv()
-openai_client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
-gcloud_client = genai.Client(http_options=HttpOptions(api_version="v1"),
-                      vertexai=os.environ.get("GOOGLE_GENAI_USE_VERTEXAI"),
-                      project=os.environ.get("GOOGLE_CLOUD_PROJECT"),
-                      location=os.environ.get("GOOGLE_CLOUD_LOCATION"))
 
-mcp = FastMCP(name="MCP Server",
-              stateless_http=False)
+# base images are reused across books for the same (name, description) pair
+character_cache = DiskCache(
+    os.environ.get("CHARACTER_CACHE_DIR", os.path.join(tempfile.gettempdir(), "storybooker_cache", "characters")),
+    max_bytes=int(os.environ.get("CHARACTER_CACHE_MAX_BYTES", str(200 * 1024 * 1024))),
+    suffix=".png",
+)
+
+# storyboards are memoized per normalized prompt and model
+storyboard_cache = TTLCache(
+    maxsize=int(os.environ.get("STORYBOARD_CACHE_SIZE", "256")),
+    ttl=float(os.environ.get("STORYBOARD_CACHE_TTL", "3600")),
+)
+storyboard_cache_lock = threading.Lock()
+STORYBOARD_MAX_ATTEMPTS = int(os.environ.get("STORYBOARD_MAX_ATTEMPTS", "3"))
+
+# character references are downscaled and re-encoded once, then reused by every scene they appear in
+REFERENCE_MAX_EDGE = int(os.environ.get("REFERENCE_MAX_EDGE", "512"))
+REFERENCE_FORMAT = os.environ.get("REFERENCE_FORMAT", "jpeg")  # "jpeg" or "webp"
+REFERENCE_QUALITY = int(os.environ.get("REFERENCE_QUALITY", "85"))
+reference_cache = TTLCache(
+    maxsize=int(os.environ.get("REFERENCE_CACHE_SIZE", "64")),
+    ttl=float(os.environ.get("REFERENCE_CACHE_TTL", "3600")),
+)
+reference_cache_lock = threading.Lock()
 
-temp_dir = tempfile.TemporaryDirectory()
+def request_storyboard(prompt: str) -> str:
+    with telemetry.stage("storyboard", provider="openai") as stage:
+        text = resilience.call("openai", model_provider().storyboard, prompt)
+        stage.record(bytes_in=len(prompt.encode("utf-8")), bytes_out=len(text.encode("utf-8")))
+    return text
+
+def parse_storyboard(text: str) -> list:
+    """
+    Purpose: Parses and validates the storyboarder model output
+    Input: text is the raw model output, optionally wrapped in a ```json code fence
+    Output: list of exactly 6 pages, each with "characters" (list of {"name", "description"}), "background" and "narration"
+            raises ValueError if the output does not match that shape
+    """
+    text = text.strip()
+    if text.startswith("```"):
+        text = text.split("\n", 1)[1].rsplit("```", 1)[0]
+    storyboard = json.loads(text)
+
+    if not isinstance(storyboard, list) or len(storyboard) != 6:
+        raise ValueError("storyboard must be a list of exactly 6 pages")
+    for index, page in enumerate(storyboard, start=1):
+        if not isinstance(page, dict):
+            raise ValueError(f"page {index} is not an object")
+        for field in ("background", "narration"):
+            if not isinstance(page.get(field), str) or not page[field].strip():
+                raise ValueError(f"page {index} is missing {field}")
+        if not isinstance(page.get("characters"), list):
+            raise ValueError(f"page {index} is missing characters")
+        for character in page["characters"]:
+            if not isinstance(character, dict) or not isinstance(character.get("name"), str) or not isinstance(character.get("description"), str):
+                raise ValueError(f"page {index} has a character without name or description")
+    return storyboard
 
-@mcp.tool()
 def storyboarder(prompt: str) -> dict:
     """
     Purpose: Given requirements for a children's story book, generates a 6 page storyboard plan that satisfies provided demands
@@ -45,87 +92,99 @@ def storyboarder(prompt: str) -> dict:
           ...
         ]
     """
-    response = openai_client.responses.create(
-        model=OPENAI_MODEL_ID,
-        instructions="""
-        You are a children's storyteller who structures story books in 6 pages.
-        Based on the user prompted story idea, create a structured 6-page storyboard.
-
-        Rules:
-        1. Each page should include 
-            - characters: list of character names in that panel and physical description of the character (eg. name: "Peppa Pig"; description: "pig, red shirt, happy, green shoes")
-            - background: point form physical description of the background scene (eg. "grass field, sunny, clouds, sparse trees, house in the distance")
-            - narration: one line that the narrator should say
-        2. Keep it engaging and age-appropriate
-        3. ONLY use standard ASCII characters (eg. use the character "'" to represent apostrophes; do not use non-standard ASCII like "’")
-        4. Return it as a JSON list of 6 panels like this:
-            [
-                {"characters": [{"name": "...",
-                                 "description": "..."},
-                                 ...
-                               ], 
-                 "background": "...", 
-                 "narration": "..." },
-                ...
-            ]
-        """,
-        input=prompt
-    )
-    return json.loads(response.output_text)
-
-@mcp.tool()
+    key = DiskCache.key(prompt, model_provider().name)
+    with storyboard_cache_lock:
+        cached = storyboard_cache.get(key)
+    if cached is not None:
+        # stdout is the MCP stdio transport, so logs go to stderr
+        print("Storyboard cache hit", file=sys.stderr)
+        return copy.deepcopy(cached)
+
+    # invalid output is retried here instead of through another agent turn
+    for attempt in range(1, STORYBOARD_MAX_ATTEMPTS + 1):
+        try:
+            storyboard = parse_storyboard(request_storyboard(prompt))
+        except ValueError as e:
+            error = e
+            print(f"Invalid storyboard (attempt {attempt}/{STORYBOARD_MAX_ATTEMPTS}): {e}", file=sys.stderr)
+            continue
+        with storyboard_cache_lock:
+            storyboard_cache[key] = storyboard
+        return copy.deepcopy(storyboard)
+    raise ValueError(f"Storyboard generation failed after {STORYBOARD_MAX_ATTEMPTS} attempts: {error}")
+
 def character_base_image_gen(name: str, description: str, output_directory: str) -> str:
     """
     Purpose: Given physical descriptions of a character, generates a base image for it
     Input: name is the name of the character in all lower case (eg. peppa pig); 
            description is the additional specified physical traits of the character being generated (eg. "pig, red shirt, happy, green shoes").
            output_directory is the directory where the generated image should be stored (eg. "/tmp/tmpkbm4cbd7")
-    Output: the generated image is stored in "{output_directory}/" as "{name}.png" where any spaces in name are replaced with underscores.
+    Output: the generated image is stored in "{output_directory}/" as "{name}.png" where any spaces in name are replaced with underscores
+            (and anything but letters, digits and underscores is dropped).
     """
     out_dir = output_directory + "/"
-    
-    traits = gcloud_client.models.generate_content(
-        model="gemini-2.5-flash",
-        contents=[
-            f"""
-            Return a specific set of defining physical traits for a children's cartoon character with:
-            name: "{name}",
-            additional description: "{description}"
-            
-            Example output for a character like "Peppa Pig":
-            
-            The character in the image is a stylized, pink pig-like figure, standing upright and facing forwards.
-            Here are its defining physical traits, with emphasis on direction:
-            *   **Head and Face:**
-                *   The head is large and distinctly pink, facing forwards, with the snout protruding forward.
-                *   Two large, white, circular eyes with small black pupils are visible on the upper part of the face, both looking forward.
-                *   A prominent, darker pink, oval-shaped snout extends forward from the center of the face, with two smaller, darker pink oval nostrils positioned vertically on its front side.
-                *   A single, darker pink, circular blush mark is located on the left cheek of the face.
-                *   A simple, downward-curving sad mouth in a darker pink hue is drawn below the eyes and centrally below the snout.
-                *   Two small, pointed, light pink ears are positioned at the top of the head, one slightly to the left and the other slightly to the right, both pointing upward.
-            *   **Body and Clothing:**
-                *   The body is covered by a solid red dress or tunic, outlined in a darker red.
-                *   The dress is bell-shaped, wider at the bottom and tapering upward towards the neck.
-            *   **Limbs and Tail:**
-                *   Two thin, pink arms extend outward from the sides of the dress, each ending in a stylized hand with three short digits. The left arm is raised and points sharply to the left of the screen, and the right arm extends rightward and slightly downward.
-                *   Two thin, pink legs extend downward from beneath the dress, ending in small, flat black shoes or hooves positioned flat on the ground and pointing forward.
-                *   A small, curly, pink pig tail protrudes from the lower left side of the character's body, just above the hem of the dress, curling upward and inward.
-            """,
-        ],
-    ).text
-    base_img = gcloud_client.models.generate_images(
-        model=IMAGEN_MODEL_ID,
-        prompt="Style: children's cartoon book\n" + traits
-    )
-    base_img.generated_images[0].image.save(out_dir + name.replace(" ", "_") + ".png")
+    out_path = out_dir + character_key(name) + ".png"
+
+    with telemetry.stage("character", provider="google", character=name) as stage:
+        cache_key = DiskCache.key(name, description, model_provider().name)
+        if character_cache.get(cache_key, out_path):
+            print(f"Character cache hit for {name}: {character_cache.stats()}", file=sys.stderr)
+            stage.record(cache_hit=True)
+            return "Tool executed successfully."
+        
+        traits = resilience.call("google", model_provider().character_traits, name, description)
+        base_img = resilience.call("google", model_provider().character_image, traits)
+        # Run.has_character trusts any file under this name, so it must never be a partial one
+        write_atomic(out_path, base_img)
+        character_cache.put(cache_key, out_path)
+        stage.record(bytes_out=len(base_img), cache_hit=False)
     
     return "Tool executed successfully."
 
-def encode_image(image_path):
-    with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode("utf-8")
+def encode_reference(image_path: str) -> str:
+    """
+    Purpose: Prepares a character base image for use as a scene reference
+    Input: image_path is the path of the base image (PNG)
+    Output: data URL of the image scaled down to REFERENCE_MAX_EDGE and encoded as REFERENCE_FORMAT;
+            cached per file, so a character appearing in several scenes is only encoded once
+    """
+    stat = os.stat(image_path)
+    key = (image_path, stat.st_mtime_ns, stat.st_size)
+    with reference_cache_lock:
+        cached = reference_cache.get(key)
+    if cached is not None:
+        return cached
+
+    with Image.open(image_path) as image:
+        image = image.convert("RGB")
+        image.thumbnail((REFERENCE_MAX_EDGE, REFERENCE_MAX_EDGE), Image.LANCZOS)
+        buffer = io.BytesIO()
+        if REFERENCE_FORMAT == "webp":
+            image.save(buffer, "WEBP", quality=REFERENCE_QUALITY, method=4)
+        else:
+            image.save(buffer, "JPEG", quality=REFERENCE_QUALITY, optimize=True)
+    data_url = f"data:image/{REFERENCE_FORMAT};base64," + base64.b64encode(buffer.getvalue()).decode("utf-8")
+
+    with reference_cache_lock:
+        reference_cache[key] = data_url
+    return data_url
+
+def generate_scene(requirements: str, images: list) -> bytes:
+    """
+    Purpose: Generates one scene image in memory
+    Input: requirements is the text requirement prompt for generating the scene image
+           images is a list of paths to the base images of the characters appearing in the scene
+    Output: PNG bytes of the generated scene; raises resilience.NoResult if the model still returned no image after retries
+    """
+    with telemetry.stage("scene", provider="openai-image") as stage, memory.held() as held:
+        references = [encode_reference(path) for path in images]
+        held.add(sum(len(reference) for reference in references))
+        # scene requests are the slow tail of a book, so a straggler gets a hedged duplicate
+        scene = resilience.call("openai-image", model_provider().scene, requirements, references, hedge=True)
+        held.add(len(scene) * 4 // 3)  # the base64 response it was decoded from
+        stage.record(bytes_in=len(requirements) + sum(len(reference) for reference in references), bytes_out=len(scene))
+    return scene
 
-@mcp.tool()
 def scene_creator(scene_index: int, requirements: str, images: list, output_directory: str) -> str:
     """
     Purpose: Given requirements for a scene in the story book, generates one image for it.
@@ -139,39 +198,29 @@ def scene_creator(scene_index: int, requirements: str, images: list, output_dire
     """
     out_dir = output_directory + "/"
     
-    base64_images = [encode_image(output_directory + "/" + path) for path in images]
-        
-    request_content = [
-        {"type": "input_text", "text": requirements},
-        ]
-    for b64_entry in base64_images:
-        request_content.append({"type": "input_image",
-                                "image_url": f"data:image/jpeg;base64,{b64_entry}",})
-    
-    response = openai_client.responses.create(
-        model=OPENAI_MODEL_ID,
-        input=[
-            {
-                "role": "user",
-                "content": request_content,
-            }
-        ],
-        tools=[{"type": "image_generation", "quality": "high", "size": PAGE_SIZE}],
-    )
-    
-    image_data = [
-        output.result for output in response.output
-        if output.type == "image_generation_call"
-    ]
-
-    if image_data:
-        image_base64 = image_data[0]
-        with open(f"{out_dir}scene_{scene_index}.png", "wb") as f:
-            f.write(base64.b64decode(image_base64))
+    # only file names inside the output directory; the names come from the model
+    scene = generate_scene(requirements, [out_dir + os.path.basename(path) for path in images])
+    with open(f"{out_dir}scene_{scene_index}.png", "wb") as f:
+        f.write(scene)
             
     return "Tool executed successfully."
 
-@mcp.tool()
+def decode_image(data: bytes) -> np.ndarray:
+    """
+    Decodes encoded image bytes (eg. PNG) into a BGR array, the layout cv2.imread returns.
+    """
+    return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+def overlay_narration(image: np.ndarray, narration: str) -> np.ndarray:
+    """
+    Purpose: Draws the narration text at the bottom of a scene image
+    Input: image is the BGR scene array, modified in place
+           narration is the narration text that should be added to the scene
+    Output: the same array, for chaining
+    """
+    with telemetry.stage("narration"):
+        return overlay_text(image, narration)
+
 def narration_writer(scene_index: int, narration: str, output_directory: str) -> str:
     """
     Purpose: Given the page number and narration of the scene, overlays the narration text on the scene image
@@ -184,46 +233,23 @@ def narration_writer(scene_index: int, narration: str, output_directory: str) ->
     out_dir = output_directory + "/"
 
     image = cv2.imread(in_dir + f"scene_{scene_index}.png")
-    img_height, img_width, img_channels = image.shape
-    wrapped_text = textwrap.wrap(text=narration, width=50)
-
-    font = cv2.FONT_HERSHEY_COMPLEX
-
-    font_size = 1
-
-    outline_color = (0, 0, 0)
-    font_color = (255, 255, 255)
-
-    font_thickness = 2
-    outline_thickness = 6
+    overlay_narration(image, narration)
 
-    for i, line in enumerate(wrapped_text):
-        textsize = cv2.getTextSize(line, font, font_size, font_thickness)[0]
-
-        text_width = textsize[0]
-        text_height = textsize[1]
+    cv2.imwrite(out_dir + f"scene_{scene_index}_narrated.png", image)
+    return "Tool executed successfully."
 
-        gap = text_height + 10
-        starting_y = int(img_height - gap - len(wrapped_text)*gap)
+def create_server():
+    """
+    Registers the tools on a FastMCP server. The mcp package is only imported here, so the pipeline
+    can call the tools in-process without loading it.
+    """
+    from mcp.server import FastMCP
 
-        y = starting_y + i * gap
-        x = int((img_width - text_width) / 2)
-        
-        # outline
-        cv2.putText(image, line, (x, y), font,
-                    font_size, 
-                    outline_color, 
-                    outline_thickness, 
-                    lineType = cv2.LINE_AA)
-        
-        # text
-        cv2.putText(image, line, (x, y), font,
-                    font_size, 
-                    font_color, 
-                    font_thickness, 
-                    lineType = cv2.LINE_AA)
+    mcp = FastMCP(name="MCP Server",
+                  stateless_http=False)
+    for tool in (storyboarder, character_base_image_gen, scene_creator, narration_writer):
+        mcp.tool()(tool)
+    return mcp
 
-    cv2.imwrite(out_dir + f"scene_{scene_index}_narrated.png", image)
-    return "Tool executed successfully."
-    
-mcp.run(transport="stdio")
\ No newline at end of file
+if __name__ == "__main__":
+    create_server().run(transport="stdio")
@@ -0,0 +1,133 @@
+import contextvars
+import os
+import resource
+import threading
+from contextlib import contextmanager
+
+from . import telemetry
+
+MB = 1024 * 1024
+# what one book is assumed to need before any book has been measured on this machine, and the floor afterwards
+JOB_MEMORY_ESTIMATE = int(os.environ.get("JOB_MEMORY_ESTIMATE", str(96 * MB)))
+# accounted bytes cover the large buffers only; interpreter and allocator overhead come on top
+# (benchmarks.bench_memory measures RSS per book at a bit over twice the accounted peak)
+JOB_MEMORY_HEADROOM = float(os.environ.get("JOB_MEMORY_HEADROOM", "3"))
+MEMORY_BUDGET_FRACTION = float(os.environ.get("MEMORY_BUDGET_FRACTION", "0.5"))
+
+
+def machine_memory() -> int:
+    """
+    Memory available to this machine or container: the cgroup limit when there is one, physical memory otherwise.
+    """
+    for path in ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        try:
+            with open(path) as f:
+                limit = f.read().strip()
+        except OSError:
+            continue
+        if limit.isdigit() and int(limit) < 1 << 60:
+            return int(limit)
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+
+
+def memory_budget() -> int:
+    """
+    Bytes that running jobs may hold together, across every process on the machine (MEMORY_BUDGET, 0 turns
+    admission control off). By default a share of the machine's memory; the rest is left to the processes themselves.
+    """
+    budget = os.environ.get("MEMORY_BUDGET")
+    if budget is not None:
+        return int(budget)
+    return int(machine_memory() * MEMORY_BUDGET_FRACTION)
+
+
+def rss_bytes() -> int:
+    """
+    Current resident set size of this process.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return peak_rss_bytes()
+
+
+def peak_rss_bytes() -> int:
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class JobMemory:
+    """
+    Bytes held by the large buffers of one job (encoded and decoded images, references, the PDF) and their peak.
+    """
+
+    def __init__(self):
+        self.held = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def charge(self, nbytes: int):
+        with self._lock:
+            self.held += nbytes
+            self.peak = max(self.peak, self.held)
+
+    def release(self, nbytes: int):
+        with self._lock:
+            self.held -= nbytes
+
+
+_current = contextvars.ContextVar("job_memory", default=None)
+
+
+@contextmanager
+def track():
+    """
+    Purpose: Accounts the memory of one job
+    Output: context manager yielding the JobMemory that held() charges to while the block runs,
+            including from threads started through telemetry.bind
+    """
+    meter = JobMemory()
+    token = _current.set(meter)
+    try:
+        yield meter
+    finally:
+        _current.reset(token)
+        telemetry.job_peak_bytes.observe(meter.peak)
+
+
+class Allocation:
+    def __init__(self, meter: JobMemory):
+        self.meter = meter
+        self.bytes = 0
+
+    def add(self, nbytes: int):
+        if self.meter:
+            self.meter.charge(nbytes)
+        self.bytes += nbytes
+
+
+@contextmanager
+def held():
+    """
+    Purpose: Charges buffers to the current job for as long as they are alive
+    Output: context manager yielding an Allocation; call add(nbytes) as buffers are created,
+            everything added is released when the block ends. Outside of track() nothing is accounted.
+    """
+    allocation = Allocation(_current.get())
+    try:
+        yield allocation
+    finally:
+        if allocation.meter:
+            allocation.meter.release(allocation.bytes)
+
+
+def job_estimate(measured_peak: int = None) -> int:
+    """
+    Purpose: Memory to reserve for one book when admitting it
+    Input: measured_peak is the largest accounted peak of recently finished books, if any
+    Output: bytes; never less than JOB_MEMORY_ESTIMATE
+    """
+    if not measured_peak:
+        return JOB_MEMORY_ESTIMATE
+    return max(JOB_MEMORY_ESTIMATE, int(measured_peak * JOB_MEMORY_HEADROOM))
@@ -0,0 +1,112 @@
+import io
+import os
+import threading
+import zlib
+
+from PIL import Image
+
+PAGE_ENCODING = os.environ.get("PDF_PAGE_ENCODING", "jpeg")  # "jpeg" (DCTDecode) or "flate" (lossless)
+JPEG_QUALITY = int(os.environ.get("PDF_JPEG_QUALITY", "70"))
+RESOLUTION = 100.0  # pixels per inch, same page size as the previous PIL export
+
+CATALOG = 1
+PAGES = 2
+
+
+class PDFWriter:
+    """
+    Writes an image-per-page PDF straight into a binary stream.
+    Each page is compressed and written as soon as it is added, so only one decoded page needs to be in memory,
+    and pages may be added from several threads in any order: `index` decides their position in the book.
+    Call close() once every page is added; it writes the page tree and cross-reference table and returns the size in bytes.
+    """
+
+    def __init__(self, stream, encoding: str = PAGE_ENCODING, quality: int = JPEG_QUALITY, resolution: float = RESOLUTION):
+        if encoding not in ("jpeg", "flate"):
+            raise ValueError(f"Unknown PDF page encoding: {encoding}")
+        self.stream = stream
+        self.encoding = encoding
+        self.quality = quality
+        self.resolution = resolution
+        self.size = 0
+        self._offsets = {}
+        self._pages = {}  # page index -> page object number
+        self._next_object = PAGES + 1
+        self._lock = threading.Lock()
+        self._write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    def _write(self, data: bytes):
+        self.stream.write(data)
+        self.size += len(data)
+
+    def _object(self, number: int, body: bytes, stream: bytes = None):
+        self._offsets[number] = self.size
+        self._write(f"{number} 0 obj\n".encode() + body)
+        if stream is not None:
+            self._write(b"\nstream\n")
+            self._write(stream)
+            self._write(b"\nendstream")
+        self._write(b"\nendobj\n")
+
+    def _encode(self, image: Image.Image) -> tuple:
+        image = image.convert("RGB")
+        if self.encoding == "jpeg":
+            buffer = io.BytesIO()
+            image.save(buffer, "JPEG", quality=self.quality, optimize=True)
+            return b"/DCTDecode", buffer.getvalue()
+        return b"/FlateDecode", zlib.compress(image.tobytes(), 6)
+
+    def add_page(self, image: Image.Image, index: int):
+        """
+        Purpose: Compresses one page and appends it to the stream
+        Input: image is the page; index is its 1-based position in the book
+        """
+        width, height = image.size
+        pdf_filter, data = self._encode(image)  # outside the lock so pages encode in parallel
+        page_width = width * 72.0 / self.resolution
+        page_height = height * 72.0 / self.resolution
+        content = f"q {page_width:.2f} 0 0 {page_height:.2f} 0 0 cm /Im0 Do Q".encode()
+
+        with self._lock:
+            if index in self._pages:
+                raise ValueError(f"Page {index} was already added")
+            image_object, content_object, page_object = range(self._next_object, self._next_object + 3)
+            self._next_object += 3
+            self._object(image_object, (
+                f"<< /Type /XObject /Subtype /Image /Width {width} /Height {height} "
+                f"/ColorSpace /DeviceRGB /BitsPerComponent 8 /Filter "
+            ).encode() + pdf_filter + f" /Length {len(data)} >>".encode(), data)
+            self._object(content_object, f"<< /Length {len(content)} >>".encode(), content)
+            self._object(page_object, (
+                f"<< /Type /Page /Parent {PAGES} 0 R /MediaBox [0 0 {page_width:.2f} {page_height:.2f}] "
+                f"/Resources << /XObject << /Im0 {image_object} 0 R >> >> /Contents {content_object} 0 R >>"
+            ).encode())
+            self._pages[index] = page_object
+
+    def close(self) -> int:
+        with self._lock:
+            kids = " ".join(f"{self._pages[index]} 0 R" for index in sorted(self._pages))
+            self._object(PAGES, f"<< /Type /Pages /Kids [{kids}] /Count {len(self._pages)} >>".encode())
+            self._object(CATALOG, f"<< /Type /Catalog /Pages {PAGES} 0 R >>".encode())
+
+            xref_offset = self.size
+            count = self._next_object
+            xref = [f"xref\n0 {count}\n", "0000000000 65535 f \n"]
+            xref += [f"{self._offsets[number]:010d} 00000 n \n" for number in range(1, count)]
+            self._write("".join(xref).encode())
+            self._write(f"trailer\n<< /Size {count} /Root {CATALOG} 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n".encode())
+            return self.size
+
+
+def build_pdf(pages, **options) -> bytes:
+    """
+    Purpose: Builds a PDF in memory from pages given in book order
+    Input: pages is an iterable of PIL images, consumed one at a time; options are passed to PDFWriter
+    Output: PDF bytes
+    """
+    buffer = io.BytesIO()
+    writer = PDFWriter(buffer, **options)
+    for index, page in enumerate(pages, start=1):
+        writer.add_page(page, index)
+    writer.close()
+    return buffer.getvalue()
@@ -0,0 +1,213 @@
+import base64
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+import numpy as np
+from PIL import Image
+
+from . import memory, mcpserver, telemetry
+from .runstore import PAGE_COUNT, Run, character_key
+
+MAX_WORKERS = int(os.environ.get("PIPELINE_MAX_WORKERS", "8"))
+# one executor serves every book of a batch, so it gets more room than a single book
+BATCH_MAX_WORKERS = int(os.environ.get("PIPELINE_BATCH_MAX_WORKERS", "16"))
+PREVIEW_SIZE = int(os.environ.get("PREVIEW_SIZE", "384"))
+
+
+@dataclass(frozen=True)
+class Character:
+    name: str
+    description: str
+
+    @property
+    def key(self) -> str:
+        return character_key(self.name)
+
+
+@dataclass(frozen=True)
+class Page:
+    """
+    One storyboard page, as returned by the storyboarder tool.
+    """
+    characters: tuple
+    background: str
+    narration: str
+
+    @classmethod
+    def from_dict(cls, page: dict) -> "Page":
+        return cls(
+            characters=tuple(Character(character["name"], character["description"]) for character in page["characters"]),
+            background=page["background"],
+            narration=page["narration"],
+        )
+
+
+def scene_requirements(page: Page) -> str:
+    """
+    Purpose: Builds the scene_creator requirements string for one storyboard page
+    Input: page is one storyboard page
+    Output: requirements prompt referencing each character by its base image file name
+    """
+    placements = [
+        f"character in {character.key}.png is {character.name} ({character.description})"
+        for character in page.characters
+    ]
+    return (
+        "Style: children's cartoon book. "
+        f"Background: {page.background}. "
+        + "; ".join(placements)
+        + f'. The scene illustrates the narration: "{page.narration}". '
+        "Do not draw any text in the image."
+    )
+
+
+def to_image(page: np.ndarray) -> Image.Image:
+    """
+    Converts a BGR page array (cv2 layout) to an RGB PIL image.
+    """
+    return Image.fromarray(np.ascontiguousarray(page[:, :, ::-1]))
+
+
+def page_preview(page: np.ndarray, size: int = PREVIEW_SIZE) -> str:
+    """
+    Purpose: Makes a small preview of a finished page for progress events
+    Input: page is the narrated BGR page array; size is the maximum edge of the preview in pixels
+    Output: base64 encoded JPEG
+    """
+    image = to_image(page)
+    image.thumbnail((size, size))
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=80)
+    return base64.b64encode(buffer.getvalue()).decode("utf-8")
+
+
+def _ignore_event(book: int, event: str, data: dict):
+    pass
+
+
+def run_pipeline(user_input: str, run: Run, max_workers: int = MAX_WORKERS, on_event=None, on_page=None) -> list:
+    """
+    Purpose: Generates all storybook pages by calling the MCP tools directly from code as a dependency graph,
+             with no LLM orchestrating them.
+             storyboard -> every unique character in parallel -> every scene as soon as its characters exist -> narration
+             Every finished stage is checkpointed in `run`, and stages already there are reused,
+             so running again after a failure (or after run.discard_page) only generates what is missing.
+    Input: user_input is the user prompt for the story
+           run holds the checkpoints of this generation (storyboard, character base images, scenes, narrated pages)
+           max_workers bounds how many tool calls run at the same time
+           on_event(event, data) is called as stages finish ("storyboard", "character", "page"); it may be called from worker threads
+           on_page(scene_index, page) receives each narrated page as soon as it is done, from a worker thread;
+           when it is given the pages are not kept in memory
+    Output: list of the 6 narrated pages as BGR arrays, in page order (None entries when on_page is given)
+    """
+    result, = run_batch(
+        [user_input], [run], max_workers,
+        on_event=on_event and (lambda book, event, data: on_event(event, data)),
+        on_page=on_page and (lambda book, scene_index, page: on_page(scene_index, page)),
+    )
+    if isinstance(result, Exception):
+        raise result
+    return result
+
+
+def run_batch(user_inputs: list, runs: list, max_workers: int = BATCH_MAX_WORKERS, on_event=None, on_page=None) -> list:
+    """
+    Purpose: Generates several storybooks together, eg. the books of a series with the same cast.
+             Every storyboard is made first, so characters can be deduplicated across books: a character is
+             generated once (keyed by its normalized name, the first description wins) and its base image is
+             linked into every run that uses it. All tool calls of the batch then share one executor,
+             so max_workers bounds the whole batch rather than each book.
+             Checkpoints work as in run_pipeline; a failing book does not stop the others.
+    Input: user_inputs are the user prompts, one per book
+           runs hold the checkpoints of each book, in the same order
+           on_event(book, event, data) and on_page(book, scene_index, page) are as in run_pipeline,
+           with the position of the book in user_inputs first
+    Output: one entry per book: the list of its narrated pages (None entries when on_page is given),
+            or the exception that made it fail
+    """
+    on_event = on_event or _ignore_event
+    outcomes = [None] * len(user_inputs)
+
+    def create_storyboard(book: int) -> list:
+        run = runs[book]
+        storyboard = run.storyboard()
+        if storyboard is None:
+            print("Generating storyboard...")
+            storyboard = mcpserver.storyboarder(user_inputs[book])
+            if len(storyboard) != PAGE_COUNT:
+                raise ValueError(f"Storyboard has {len(storyboard)} pages, expected {PAGE_COUNT}")
+            run.save_storyboard(storyboard)
+        on_event(book, "storyboard", {"pages": storyboard})
+        return [Page.from_dict(page) for page in storyboard]
+
+    def create_character(character: Character, books: list):
+        # reuse a checkpoint from any run of the batch before generating it
+        source = next((runs[book] for book in books if runs[book].has_character(character.key)), None)
+        if source is None:
+            source = runs[books[0]]
+            print(f"Generating character {character.key}...")
+            mcpserver.character_base_image_gen(character.key, character.description, source.directory)
+        for book in books:
+            runs[book].link_character(character.key, source.character_path(character.key))
+            on_event(book, "character", {"name": character.key})
+
+    def create_page(book: int, scene_index: int, page: Page) -> np.ndarray:
+        run = runs[book]
+        images = []
+        for character in page.characters:
+            characters[character.key].result()
+            images.append(run.character_path(character.key))
+
+        # the page is accounted to the job until it is handed over (or returned, when it is kept in memory anyway)
+        with memory.held() as held:
+            with telemetry.stage("page", page=scene_index) as stage:
+                narrated = run.page(scene_index)
+                stage.record(resumed=narrated is not None)
+                if narrated is None:
+                    scene = run.scene(scene_index)
+                    if scene is None:
+                        scene = mcpserver.generate_scene(scene_requirements(page), images)
+                        run.save_scene(scene_index, scene)
+                    held.add(len(scene))
+                    narrated = mcpserver.overlay_narration(mcpserver.decode_image(scene), page.narration)
+                    run.save_page(scene_index, narrated)
+                    print(f"Page {scene_index} done.")
+            held.add(narrated.nbytes)
+            on_event(book, "page", {"page": scene_index, "preview": page_preview(narrated)})
+            if on_page:
+                on_page(book, scene_index, narrated)
+                return None
+            return narrated
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        storyboards = [executor.submit(telemetry.bind(create_storyboard), book) for book in range(len(user_inputs))]
+        books = {}
+        for book, storyboard in enumerate(storyboards):
+            try:
+                books[book] = storyboard.result()
+            except Exception as e:
+                outcomes[book] = e
+
+        cast = {}
+        for book, pages in books.items():
+            for page in pages:
+                for character in page.characters:
+                    _, users = cast.setdefault(character.key, (character, []))
+                    if book not in users:
+                        users.append(book)
+
+        # Tasks are picked up in submission order, so every character task has already started
+        # by the time a scene task blocks on it; scenes can never starve the characters they wait on.
+        characters = {key: executor.submit(telemetry.bind(create_character), character, users)
+                      for key, (character, users) in cast.items()}
+        results = {book: [executor.submit(telemetry.bind(create_page), book, index, page)
+                          for index, page in enumerate(pages, start=1)]
+                   for book, pages in books.items()}
+        for book, pages in results.items():
+            try:
+                outcomes[book] = [page.result() for page in pages]
+            except Exception as e:
+                outcomes[book] = e
+    return outcomes
@@ -0,0 +1,281 @@
+import abc
+import base64
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+
+import httpx
+
+from . import clients, resilience
+
+OPENAI_MODEL_ID = "gpt-4.1-nano" # "gpt-4.1"
+IMAGEN_MODEL_ID = "imagen-3.0-fast-generate-001" # "imagen-3.0-generate-002"
+TRAITS_MODEL_ID = "gemini-2.5-flash"
+PAGE_SIZE = "1024x1024"
+
+MODEL_PROVIDER = os.environ.get("MODEL_PROVIDER", "live")  # "live" or "fake"
+RES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "res")
+
+
+def _openai():
+    # the request times out at the deadline of the attempt making it, see resilience.remaining
+    return clients.openai_client().with_options(timeout=resilience.remaining(clients.TIMEOUT))
+
+
+def _genai_options():
+    from google.genai.types import HttpOptions
+    return HttpOptions(timeout=int(resilience.remaining(clients.TIMEOUT) * 1000))  # milliseconds
+
+
+class ModelProvider(abc.ABC):
+    """
+    The remote model calls behind the MCP tools. Each method is a single attempt;
+    retries, limits and hedging are applied by the caller through resilience.call,
+    and an answer without the expected output raises resilience.NoResult.
+    `name` is part of every cache key, so results from different providers never mix.
+    """
+
+    name = None
+
+    @abc.abstractmethod
+    def storyboard(self, prompt: str) -> str:
+        """
+        Returns the raw storyboard text (a JSON list of 6 pages) for the user prompt.
+        """
+
+    @abc.abstractmethod
+    def character_traits(self, name: str, description: str) -> str:
+        """
+        Returns a detailed physical description of the character.
+        """
+
+    @abc.abstractmethod
+    def character_image(self, traits: str) -> bytes:
+        """
+        Returns PNG bytes of a base image drawn from the traits.
+        """
+
+    @abc.abstractmethod
+    def scene(self, requirements: str, references: list) -> bytes:
+        """
+        Returns PNG bytes of a scene; references are data URLs of the character base images in it.
+        """
+
+
+class LiveModelProvider(ModelProvider):
+    """
+    OpenAI for the storyboard and scenes, Gemini for character traits and Imagen for character base images.
+    """
+
+    name = f"live:{OPENAI_MODEL_ID}:{TRAITS_MODEL_ID}:{IMAGEN_MODEL_ID}"
+
+    def storyboard(self, prompt: str) -> str:
+        response = _openai().responses.create(
+            model=OPENAI_MODEL_ID,
+            instructions="""
+            You are a children's storyteller who structures story books in 6 pages.
+            Based on the user prompted story idea, create a structured 6-page storyboard.
+
+            Rules:
+            1. Each page should include 
+                - characters: list of character names in that panel and physical description of the character (eg. name: "Peppa Pig"; description: "pig, red shirt, happy, green shoes")
+                - background: point form physical description of the background scene (eg. "grass field, sunny, clouds, sparse trees, house in the distance")
+                - narration: one line that the narrator should say
+            2. Keep it engaging and age-appropriate
+            3. ONLY use standard ASCII characters (eg. use the character "'" to represent apostrophes; do not use non-standard ASCII like "’")
+            4. Return it as a JSON list of 6 panels like this:
+                [
+                    {"characters": [{"name": "...",
+                                     "description": "..."},
+                                     ...
+                                   ], 
+                     "background": "...", 
+                     "narration": "..." },
+                    ...
+                ]
+            """,
+            input=prompt
+        )
+        return response.output_text
+
+    def character_traits(self, name: str, description: str) -> str:
+        from google.genai.types import GenerateContentConfig
+        return clients.genai_client().models.generate_content(
+            model=TRAITS_MODEL_ID,
+            config=GenerateContentConfig(http_options=_genai_options()),
+            contents=[
+                f"""
+                Return a specific set of defining physical traits for a children's cartoon character with:
+                name: "{name}",
+                additional description: "{description}"
+            
+                Example output for a character like "Peppa Pig":
+            
+                The character in the image is a stylized, pink pig-like figure, standing upright and facing forwards.
+                Here are its defining physical traits, with emphasis on direction:
+                *   **Head and Face:**
+                    *   The head is large and distinctly pink, facing forwards, with the snout protruding forward.
+                    *   Two large, white, circular eyes with small black pupils are visible on the upper part of the face, both looking forward.
+                    *   A prominent, darker pink, oval-shaped snout extends forward from the center of the face, with two smaller, darker pink oval nostrils positioned vertically on its front side.
+                    *   A single, darker pink, circular blush mark is located on the left cheek of the face.
+                    *   A simple, downward-curving sad mouth in a darker pink hue is drawn below the eyes and centrally below the snout.
+                    *   Two small, pointed, light pink ears are positioned at the top of the head, one slightly to the left and the other slightly to the right, both pointing upward.
+                *   **Body and Clothing:**
+                    *   The body is covered by a solid red dress or tunic, outlined in a darker red.
+                    *   The dress is bell-shaped, wider at the bottom and tapering upward towards the neck.
+                *   **Limbs and Tail:**
+                    *   Two thin, pink arms extend outward from the sides of the dress, each ending in a stylized hand with three short digits. The left arm is raised and points sharply to the left of the screen, and the right arm extends rightward and slightly downward.
+                    *   Two thin, pink legs extend downward from beneath the dress, ending in small, flat black shoes or hooves positioned flat on the ground and pointing forward.
+                    *   A small, curly, pink pig tail protrudes from the lower left side of the character's body, just above the hem of the dress, curling upward and inward.
+                """,
+            ],
+        ).text
+
+    def character_image(self, traits: str) -> bytes:
+        from google.genai.types import GenerateImagesConfig
+        response = clients.genai_client().models.generate_images(
+            model=IMAGEN_MODEL_ID,
+            prompt="Style: children's cartoon book\n" + traits,
+            config=GenerateImagesConfig(http_options=_genai_options()),
+        )
+        if not response.generated_images:
+            raise resilience.NoResult("No base image was generated")
+        return response.generated_images[0].image.image_bytes
+
+    def scene(self, requirements: str, references: list) -> bytes:
+        request_content = [
+            {"type": "input_text", "text": requirements},
+            ]
+        for reference in references:
+            request_content.append({"type": "input_image",
+                                    "image_url": reference,})
+
+        response = _openai().responses.create(
+            model=OPENAI_MODEL_ID,
+            input=[
+                {
+                    "role": "user",
+                    "content": request_content,
+                }
+            ],
+            tools=[{"type": "image_generation", "quality": "high", "size": PAGE_SIZE}],
+        )
+        
+        image_data = [
+            output.result for output in response.output
+            if output.type == "image_generation_call"
+        ]
+
+        if not image_data:
+            raise resilience.NoResult("No image was generated for the scene")
+        return base64.b64decode(image_data[0])
+
+
+FAKE_CHARACTERS = [
+    ("Binky the Bunny", "small grey bunny, long ears, blue scarf"),
+    ("Lily the Ladybug", "red ladybug, black spots, big smile"),
+    ("Ms Owl", "brown owl, round glasses, teacher"),
+    ("Sam the Squirrel", "red squirrel, bushy tail, green backpack"),
+]
+FAKE_BACKGROUNDS = [
+    "forest clearing, sunny, tall trees, flowers",
+    "school classroom, wooden desks, chalkboard",
+    "grass field, clouds, sparse trees, house in the distance",
+    "small stage, red curtains, spotlights",
+]
+FAKE_NARRATIONS = [
+    "Binky the bunny was scared of everything, even the tiny leaves that rustled in the wind.",
+    "One morning, Ms. Owl told the class they would put on a play in front of the whole school.",
+    "Binky's ears drooped. \"I can't stand up there,\" he whispered to his friend Sam the squirrel.",
+    "Sam smiled and said, \"Being brave doesn't mean you aren't scared. It means you try anyway.\"",
+    "On the day of the play, Binky took a deep breath, hopped onto the stage and said his lines.",
+    "Everyone clapped and cheered, and Binky learned that he was braver than he ever knew.",
+]
+
+
+class FakeModelProvider(ModelProvider):
+    """
+    Offline stand-in that answers from the fixtures in backend/res after a simulated delay, for benchmarks and local runs.
+    Answers are deterministic for a given input. `latency` is the mean delay in seconds per call type,
+    multiplied by `scale` and varied by +-`jitter`; `failure_rate` of calls answer without output, to exercise retries.
+    """
+
+    name = "fake"
+    LATENCY = {"storyboard": 4.0, "character_traits": 3.0, "character_image": 6.0, "scene": 30.0}
+
+    def __init__(self, latency: dict = None, scale: float = float(os.environ.get("FAKE_LATENCY_SCALE", "1.0")),
+                 jitter: float = float(os.environ.get("FAKE_LATENCY_JITTER", "0.25")),
+                 failure_rate: float = float(os.environ.get("FAKE_FAILURE_RATE", "0")), res_dir: str = RES_DIR):
+        self.latency = dict(self.LATENCY, **(latency or {}))
+        self.scale = scale
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.res_dir = res_dir
+        self._random = random.Random(0)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _seed(*parts) -> int:
+        return int(hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()[:16], 16)
+
+    def _call(self, kind: str):
+        with self._lock:
+            delay = self.latency[kind] * self.scale * self._random.uniform(1 - self.jitter, 1 + self.jitter)
+            failed = self._random.random() < self.failure_rate
+        timeout = resilience.remaining(clients.TIMEOUT)
+        if delay > timeout:
+            # like the real clients, the request gives up at the deadline of the attempt making it
+            time.sleep(timeout)
+            raise httpx.ReadTimeout(f"Simulated {kind} request timed out")
+        time.sleep(delay)
+        if failed:
+            raise resilience.NoResult(f"Simulated empty {kind} response")
+
+    def _fixture(self, *path) -> bytes:
+        with open(os.path.join(self.res_dir, *path), "rb") as f:
+            return f.read()
+
+    def storyboard(self, prompt: str) -> str:
+        self._call("storyboard")
+        rng = random.Random(self._seed(prompt))
+        cast = rng.sample(FAKE_CHARACTERS, 3)
+        pages = []
+        for index in range(6):
+            characters = rng.sample(cast, rng.randint(1, 3))
+            pages.append({
+                "characters": [{"name": name, "description": description} for name, description in characters],
+                "background": rng.choice(FAKE_BACKGROUNDS),
+                "narration": FAKE_NARRATIONS[index],
+            })
+        return json.dumps(pages)
+
+    def character_traits(self, name: str, description: str) -> str:
+        self._call("character_traits")
+        return f"{name}: {description}"
+
+    def character_image(self, traits: str) -> bytes:
+        self._call("character_image")
+        name = traits.split(":", 1)[0].lower().replace(" ", "_")
+        files = sorted(os.listdir(os.path.join(self.res_dir, "base")))
+        if name + ".png" not in files:
+            name = files[self._seed(traits) % len(files)][:-4]
+        return self._fixture("base", name + ".png")
+
+    def scene(self, requirements: str, references: list) -> bytes:
+        self._call("scene")
+        return self._fixture("scene", f"scene_{self._seed(requirements) % 6 + 1}.png")
+
+
+_provider = None
+_provider_lock = threading.Lock()
+
+
+def model_provider() -> ModelProvider:
+    global _provider
+    with _provider_lock:
+        if _provider is None:
+            _provider = FakeModelProvider() if MODEL_PROVIDER == "fake" else LiveModelProvider()
+        return _provider
@@ -0,0 +1,134 @@
+import os
+import random
+import sys
+import threading
+import time
+
+from . import telemetry
+
+QUOTA_BACKEND = os.environ.get("QUOTA_BACKEND", "supabase")  # "supabase" or "local"
+MAX_ATTEMPTS = int(os.environ.get("QUOTA_MAX_ATTEMPTS", "5"))
+# a refund is only raced by the same user's own requests, so it keeps trying (with backoff) much longer than a reservation
+REFUND_MAX_ATTEMPTS = int(os.environ.get("QUOTA_REFUND_MAX_ATTEMPTS", "20"))
+REFUND_BACKOFF = 0.05
+REFUND_BACKOFF_CAP = 1.0
+
+
+class QuotaExceeded(Exception):
+    pass
+
+
+class ProfileNotFound(Exception):
+    pass
+
+
+class RefundFailed(Exception):
+    pass
+
+
+class Reservation:
+    """
+    One generation taken from a user's quota. Call commit() once the storybook is stored,
+    or refund() if it could not be produced; whichever comes first wins and the other becomes a no-op.
+    """
+
+    def __init__(self, quota, user_id: str):
+        self.quota = quota
+        self.user_id = user_id
+        self._settled = False
+        self._lock = threading.Lock()
+
+    def _settle(self) -> bool:
+        with self._lock:
+            if self._settled:
+                return False
+            self._settled = True
+            return True
+
+    def commit(self):
+        self._settle()
+
+    def refund(self):
+        """
+        Gives the generation back. A refund that cannot be made is reported as an error (and counted in
+        storybooker_quota_refund_failures_total) rather than raised, so it never hides the error that caused it.
+        """
+        if not self._settle():
+            return
+        try:
+            self.quota.refund(self.user_id)
+        except Exception as e:
+            telemetry.quota_refund_failures.inc()
+            print(f"ERROR: could not refund a generation to {self.user_id}: {type(e).__name__}: {e}", file=sys.stderr)
+
+
+class SupabaseQuota:
+    """
+    Generation quota stored in profiles.remaining_gens.
+    Both directions are compare-and-set updates (`... .eq("remaining_gens", seen)`), so two concurrent
+    requests can never both spend the last generation and a refund never overwrites a concurrent reservation.
+    """
+
+    def __init__(self, supabase, max_attempts: int = MAX_ATTEMPTS, refund_attempts: int = REFUND_MAX_ATTEMPTS):
+        self.supabase = supabase
+        self.max_attempts = max_attempts
+        self.refund_attempts = refund_attempts
+
+    def _remaining(self, user_id: str):
+        response = self.supabase.table("profiles").select("remaining_gens").eq("user_id", user_id).maybe_single().execute()
+        if not response or not response.data:
+            raise ProfileNotFound(user_id)
+        return response.data.get("remaining_gens")
+
+    def _compare_and_set(self, user_id: str, seen: int, value: int) -> bool:
+        return bool(
+            self.supabase.table("profiles").update({"remaining_gens": value})
+            .eq("user_id", user_id).eq("remaining_gens", seen).execute().data
+        )
+
+    def reserve(self, user_id: str) -> Reservation:
+        for _ in range(self.max_attempts):
+            remaining = self._remaining(user_id)
+            if remaining is None or remaining <= 0:
+                raise QuotaExceeded(user_id)
+            if self._compare_and_set(user_id, remaining, remaining - 1):
+                return Reservation(self, user_id)
+        raise RuntimeError("Could not reserve a generation, please try again")
+
+    def refund(self, user_id: str):
+        for attempt in range(self.refund_attempts):
+            remaining = self._remaining(user_id) or 0
+            if self._compare_and_set(user_id, remaining, remaining + 1):
+                return
+            time.sleep(random.uniform(0, min(REFUND_BACKOFF_CAP, REFUND_BACKOFF * 2 ** attempt)))
+        raise RefundFailed(f"remaining_gens of {user_id} kept changing")
+
+
+class LocalQuota:
+    """
+    In-memory stand-in for SupabaseQuota, for tests and local runs without a profiles table.
+    Users not in `balances` start with `default` generations.
+    """
+
+    def __init__(self, balances: dict = None, default: int = int(os.environ.get("LOCAL_QUOTA_GENERATIONS", "10"))):
+        self.balances = dict(balances or {})
+        self.default = default
+        self._lock = threading.Lock()
+
+    def reserve(self, user_id: str) -> Reservation:
+        with self._lock:
+            remaining = self.balances.setdefault(user_id, self.default)
+            if remaining <= 0:
+                raise QuotaExceeded(user_id)
+            self.balances[user_id] = remaining - 1
+        return Reservation(self, user_id)
+
+    def refund(self, user_id: str):
+        with self._lock:
+            self.balances[user_id] = self.balances.get(user_id, self.default) + 1
+
+
+def create_quota(supabase):
+    if QUOTA_BACKEND == "local":
+        return LocalQuota()
+    return SupabaseQuota(supabase)
@@ -0,0 +1,278 @@
+import contextvars
+import os
+import random
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import httpx
+
+MAX_ATTEMPT_THREADS = int(os.environ.get("RESILIENCE_THREADS", "32"))
+BACKOFF_BASE = float(os.environ.get("RETRY_BACKOFF_BASE", "1.0"))
+BACKOFF_CAP = float(os.environ.get("RETRY_BACKOFF_CAP", "20.0"))
+LATENCY_WINDOW = 100  # recent successful calls used for the p95 hedge threshold
+MIN_SAMPLES_FOR_HEDGE = 10
+SLOT_POLL_INTERVAL = 0.1  # how often an attempt waiting for a slot checks whether it was cancelled
+MIN_REQUEST_TIMEOUT = 1.0
+
+
+class NoResult(Exception):
+    """
+    The provider answered but without the expected output (eg. no image); worth asking again.
+    """
+
+
+class CallTimeout(Exception):
+    pass
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, (NoResult, CallTimeout, httpx.TimeoutException, httpx.TransportError)):
+        return True
+    try:
+        import openai
+        if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError)):
+            return True
+    except ImportError:
+        pass
+    try:
+        from google.genai import errors
+        if isinstance(error, errors.ServerError):
+            return True
+        if isinstance(error, errors.ClientError) and error.code in (408, 429):
+            return True
+    except ImportError:
+        pass
+    return False
+
+
+_deadline = contextvars.ContextVar("call_deadline", default=None)
+
+
+def remaining(default: float) -> float:
+    """
+    Purpose: Time left for the provider request being made on this thread
+    Input: default is returned outside of call(), eg. the HTTP client's own timeout
+    Output: seconds until the deadline of the current attempt (at least MIN_REQUEST_TIMEOUT); clients pass it on
+            as the request timeout, so an attempt given up at its deadline does not keep waiting on the request
+    """
+    deadline = _deadline.get()
+    if deadline is None:
+        return default
+    return max(deadline - time.monotonic(), MIN_REQUEST_TIMEOUT)
+
+
+class Cancelled(Exception):
+    """
+    The attempt was given up (timed out or no longer needed) before it called the provider.
+    """
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _wait_time(self) -> float:
+        # takes a token and returns 0, or returns how long until one is available
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+    def take(self, cancelled: threading.Event = None):
+        # blocks until a token is available; rate <= 0 means unlimited
+        if self.rate <= 0:
+            return
+        while True:
+            wait_for = self._wait_time()
+            if not wait_for:
+                return
+            if cancelled is not None and cancelled.wait(wait_for):
+                raise Cancelled()
+            if cancelled is None:
+                time.sleep(wait_for)
+
+    def try_take(self) -> bool:
+        return self.rate <= 0 or not self._wait_time()
+
+
+class Attempt:
+    """
+    One request to a provider. `started` is set once it holds a concurrency slot (or has finished without one),
+    which is when its deadline and hedge timer start; setting `cancelled` makes it give up if it has not called fn yet.
+    """
+
+    def __init__(self):
+        self.started = threading.Event()
+        self.started_at = None
+        self.cancelled = threading.Event()
+
+
+class Provider:
+    """
+    Limits and retry policy for one remote API.
+    `concurrency` caps in-flight attempts (hedges included) and `rate`/`burst` is a token bucket of requests per second.
+    A hedged call starts a duplicate attempt once the first has run longer than `hedge_after` seconds,
+    or, when that is not set, longer than the p95 of recent successful calls; only if a slot and a token are free
+    right away, a provider at its limit gets no duplicates.
+    """
+
+    def __init__(self, name: str, concurrency: int, rate: float, burst: int, timeout: float, retries: int, hedge_after: float = 0):
+        self.name = name
+        self.timeout = timeout
+        self.retries = retries
+        self.hedge_after = hedge_after
+        self.bucket = TokenBucket(rate, burst)
+        self._slots = threading.BoundedSemaphore(concurrency)
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, name: str, prefix: str, concurrency: int, rate: float, timeout: float, retries: int = 3):
+        return cls(
+            name,
+            concurrency=int(os.environ.get(f"{prefix}_CONCURRENCY", concurrency)),
+            rate=float(os.environ.get(f"{prefix}_RATE", rate)),
+            burst=int(os.environ.get(f"{prefix}_BURST", concurrency)),
+            timeout=float(os.environ.get(f"{prefix}_TIMEOUT", timeout)),
+            retries=int(os.environ.get(f"{prefix}_RETRIES", retries)),
+            hedge_after=float(os.environ.get(f"{prefix}_HEDGE_AFTER", 0)),
+        )
+
+    def record(self, seconds: float):
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def hedge_delay(self) -> float:
+        if self.hedge_after > 0:
+            return self.hedge_after
+        with self._lock:
+            if len(self._latencies) < MIN_SAMPLES_FOR_HEDGE:
+                return None
+            ordered = sorted(self._latencies)
+        return ordered[int(len(ordered) * 0.95) - 1]
+
+    def run(self, attempt: Attempt, fn, *args, **kwargs):
+        """
+        One attempt inside the provider's rate and concurrency limits. Waiting for them does not count
+        against the attempt's deadline, and an attempt cancelled while it waits never calls fn.
+        """
+        try:
+            self.bucket.take(attempt.cancelled)
+            while not self._slots.acquire(timeout=SLOT_POLL_INTERVAL):
+                if attempt.cancelled.is_set():
+                    raise Cancelled()
+        except Cancelled:
+            attempt.started.set()
+            raise
+        return self._call(attempt, fn, args, kwargs)
+
+    def try_run(self, attempt: Attempt, fn, *args, **kwargs):
+        """
+        Like run, but only if a slot and a token are free right now; otherwise raises Cancelled without waiting.
+        """
+        if not self._slots.acquire(blocking=False):
+            raise Cancelled()
+        if not self.bucket.try_take():
+            self._slots.release()
+            raise Cancelled()
+        return self._call(attempt, fn, args, kwargs)
+
+    def _call(self, attempt: Attempt, fn, args, kwargs):
+        # holds a slot; releases it when done
+        attempt.started_at = time.monotonic()
+        attempt.started.set()
+        token = _deadline.set(attempt.started_at + self.timeout)
+        try:
+            if attempt.cancelled.is_set():
+                raise Cancelled()
+            result = fn(*args, **kwargs)
+            self.record(time.monotonic() - attempt.started_at)
+            return result
+        finally:
+            _deadline.reset(token)
+            self._slots.release()
+
+
+PROVIDERS = {
+    "openai": Provider.from_env("openai", "OPENAI", concurrency=8, rate=5, timeout=60),
+    "openai-image": Provider.from_env("openai-image", "OPENAI_IMAGE", concurrency=6, rate=1, timeout=240),
+    "google": Provider.from_env("google", "GOOGLE", concurrency=8, rate=5, timeout=120),
+}
+
+# logs go to stderr: in the MCP server stdout is the stdio transport
+_attempts = ThreadPoolExecutor(max_workers=MAX_ATTEMPT_THREADS, thread_name_prefix="remote-call")
+
+
+def _attempt(provider: Provider, fn, args, kwargs, hedge: bool):
+    """
+    Runs one attempt with a deadline, plus at most one hedged duplicate; returns the first successful result.
+    The deadline and the hedge timer start once the attempt holds a slot, not while it waits for one.
+    Attempts that lose the race or run past the deadline are cancelled: one that has not called the provider yet
+    never does, one already waiting on it stops when its request times out at the same deadline (see remaining()).
+    """
+    primary = Attempt()
+    pending = {_attempts.submit(provider.run, primary, fn, *args, **kwargs)}
+    attempts = [primary]
+    primary.started.wait()
+    started_at = primary.started_at or time.monotonic()
+    deadline = started_at + provider.timeout
+    hedge_delay = provider.hedge_delay() if hedge else None
+    hedge_at = started_at + hedge_delay if hedge_delay is not None else None
+    error = None
+
+    try:
+        while pending:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            wait_for = min(deadline, hedge_at) - now if hedge_at is not None else deadline - now
+            done, pending = wait(pending, timeout=max(wait_for, 0), return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                if not isinstance(future.exception(), Cancelled):
+                    error = future.exception()
+            if hedge_at is not None and pending and time.monotonic() >= hedge_at:
+                hedge_at = None
+                print(f"Hedging slow {provider.name} call after {hedge_delay:.1f}s", file=sys.stderr)
+                duplicate = Attempt()
+                attempts.append(duplicate)
+                pending.add(_attempts.submit(provider.try_run, duplicate, fn, *args, **kwargs))
+    finally:
+        for attempt in attempts:
+            attempt.cancelled.set()
+
+    if pending:
+        raise CallTimeout(f"{provider.name} call timed out after {provider.timeout:.1f}s")
+    raise error
+
+
+def call(provider_name: str, fn, *args, hedge: bool = False, **kwargs):
+    """
+    Purpose: Calls a remote API with a per-call timeout, jittered exponential retries on retryable errors,
+             the provider's rate and concurrency limits, and optionally a hedged duplicate request
+    Input: provider_name is a key of PROVIDERS; fn(*args, **kwargs) performs the call;
+           hedge should only be set for calls that are safe to send twice
+    Output: fn's result; the last error is raised once retries are exhausted or on a non-retryable error
+    """
+    provider = PROVIDERS[provider_name]
+    for attempt in range(provider.retries + 1):
+        try:
+            return _attempt(provider, fn, args, kwargs, hedge)
+        except Exception as e:
+            if attempt == provider.retries or not is_retryable(e):
+                raise
+            delay = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+            print(f"{provider.name} call failed ({type(e).__name__}: {e}), retrying in {delay:.1f}s", file=sys.stderr)
+            time.sleep(delay)
@@ -0,0 +1,135 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+
+from .cache import link_atomic, write_atomic
+
+PAGE_COUNT = 6  # pages per storybook; a run holds one scene of each
+RUNS_DIR = os.environ.get("RUNS_DIR", os.path.join(tempfile.gettempdir(), "storybooker_runs"))
+# finished runs are kept this long so single pages can still be regenerated
+RUN_RETENTION = float(os.environ.get("RUN_RETENTION", str(7 * 24 * 3600)))
+
+
+def character_key(name: str) -> str:
+    """
+    Purpose: Normalizes a character name the same way the agent is instructed to (lower case, underscores)
+             and makes it safe as a file name: names come from model output the user's prompt can steer
+    Input: name is the character name from the storyboard (eg. "Peppa Pig")
+    Output: normalized name of only a-z, 0-9 and "_" (eg. "peppa_pig"), or a hash of the name if none of it is left;
+            the base image is stored as "{key}.png"
+    """
+    key = re.sub(r"[^a-z0-9_]", "", "_".join(name.lower().split())).strip("_")
+    return key or "character_" + hashlib.sha256(name.encode("utf-8")).hexdigest()[:16]
+
+
+class Run:
+    """
+    Checkpoints of one generation run, kept in a single directory with the same file names the MCP tools use:
+    "storyboard.json", "{character}.png" base images, "scene_{n}.png" scenes and "scene_{n}_narrated.png" pages.
+    Every checkpoint is written to a temporary file and renamed, so a crash never leaves a partial one behind.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _write(self, name: str, data: bytes):
+        write_atomic(self.path(name), data)
+
+    def _read(self, name: str) -> bytes:
+        try:
+            with open(self.path(name), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def storyboard(self) -> list:
+        data = self._read("storyboard.json")
+        return json.loads(data) if data else None
+
+    def save_storyboard(self, storyboard: list):
+        self._write("storyboard.json", json.dumps(storyboard).encode("utf-8"))
+
+    def character_path(self, key: str) -> str:
+        # keys are already normalized; normalizing again is a no-op for them and keeps any other name inside the run
+        return self.path(character_key(key) + ".png")
+
+    def has_character(self, key: str) -> bool:
+        return os.path.exists(self.character_path(key))
+
+    def link_character(self, key: str, source: str):
+        """
+        Makes the base image at `source` (usually in another run) this run's image of `key`,
+        as a hard link when both are on the same file system and as a copy otherwise.
+        """
+        if os.path.exists(self.character_path(key)) or os.path.abspath(source) == os.path.abspath(self.character_path(key)):
+            return
+        link_atomic(source, self.character_path(key))
+
+    def scene(self, index: int) -> bytes:
+        return self._read(f"scene_{index}.png")
+
+    def save_scene(self, index: int, data: bytes):
+        self._write(f"scene_{index}.png", data)
+
+    def page(self, index: int):
+        """
+        Returns the narrated page as a BGR array, or None if it has not been made yet.
+        """
+        import cv2  # only the generation path needs OpenCV; the API imports this module at startup
+
+        if not os.path.exists(self.path(f"scene_{index}_narrated.png")):
+            return None
+        return cv2.imread(self.path(f"scene_{index}_narrated.png"))
+
+    def save_page(self, index: int, page):
+        import cv2
+
+        ok, encoded = cv2.imencode(".png", page)
+        if not ok:
+            raise ValueError(f"Could not encode page {index}")
+        self._write(f"scene_{index}_narrated.png", encoded.tobytes())
+
+    def discard_page(self, index: int):
+        """
+        Drops the scene and narrated page so the next run generates them again; everything else is kept.
+        """
+        for name in (f"scene_{index}.png", f"scene_{index}_narrated.png"):
+            try:
+                os.remove(self.path(name))
+            except FileNotFoundError:
+                pass
+
+
+class RunStore:
+    """
+    Run checkpoints keyed by job ID, on local disk next to the job queue.
+    """
+
+    def __init__(self, directory: str = RUNS_DIR, retention: float = RUN_RETENTION):
+        self.directory = directory
+        self.retention = retention
+        os.makedirs(directory, exist_ok=True)
+
+    def open(self, run_id: str) -> Run:
+        return Run(os.path.join(self.directory, run_id))
+
+    def exists(self, run_id: str) -> bool:
+        return os.path.isdir(os.path.join(self.directory, run_id))
+
+    def prune(self):
+        """
+        Removes runs that have not been touched for longer than `retention` seconds.
+        """
+        cutoff = time.time() - self.retention
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.is_dir() and entry.stat().st_mtime < cutoff:
+                    shutil.rmtree(entry.path, ignore_errors=True)
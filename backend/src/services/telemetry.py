@@ -0,0 +1,224 @@
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from opentelemetry import context, trace
+
+SERVICE_NAME = os.environ.get("OTEL_SERVICE_NAME", "storybooker")
+STAGE_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+BYTE_BUCKETS = tuple(2 ** power * 1024 * 1024 for power in range(0, 11))  # 1 MB .. 1 GB
+
+# without an SDK configured the OpenTelemetry API hands out no-op spans, so tracing costs next to nothing by default
+tracer = trace.get_tracer(SERVICE_NAME)
+
+
+def configure_tracing():
+    """
+    Installs an SDK tracer provider when OTEL_TRACES_EXPORTER is "console" or "otlp"
+    ("otlp" needs opentelemetry-exporter-otlp-proto-http, which is not a default dependency).
+    Nothing is installed otherwise, which also leaves room for `opentelemetry-instrument` to configure it.
+    """
+    exporter_name = os.environ.get("OTEL_TRACES_EXPORTER", "none")
+    if exporter_name not in ("console", "otlp") or isinstance(trace.get_tracer_provider(), _sdk_provider_type()):
+        return
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+    if exporter_name == "otlp":
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        exporter = OTLPSpanExporter()
+    else:
+        exporter = ConsoleSpanExporter()
+    provider = TracerProvider(resource=Resource.create({"service.name": SERVICE_NAME}))
+    provider.add_span_processor(BatchSpanProcessor(exporter))
+    trace.set_tracer_provider(provider)
+
+
+def _sdk_provider_type():
+    try:
+        from opentelemetry.sdk.trace import TracerProvider
+        return TracerProvider
+    except ImportError:
+        return ()
+
+
+def _labels(names: tuple, values: tuple) -> str:
+    if not names:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in values)
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, escaped)) + "}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, _labels(self.labels, key), value) for key, value in sorted(self._values.items())]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labels, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, value: float, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: tuple = (), buckets: tuple = STAGE_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = buckets
+        self._values = {}  # labels -> [bucket counts..., count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels):
+        with self._lock:
+            counts = self._values.setdefault(labels, [0] * (len(self.buckets) + 2))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            counts[-2] += 1
+            counts[-1] += value
+
+    def counts(self) -> dict:
+        # labels -> number of observations
+        with self._lock:
+            return {key: counts[-2] for key, counts in self._values.items()}
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, counts in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, counts):
+                    samples.append((self.name + "_bucket", _labels(self.labels + ("le",), key + (bound,)), count))
+                samples.append((self.name + "_bucket", _labels(self.labels + ("le",), key + ("+Inf",)), counts[-2]))
+                samples.append((self.name + "_count", _labels(self.labels, key), counts[-2]))
+                samples.append((self.name + "_sum", _labels(self.labels, key), counts[-1]))
+        return samples
+
+
+class Registry:
+    """
+    Metrics of this process in the Prometheus text format. Every gunicorn worker keeps its own,
+    so a scrape shows the worker that answered it (label targets per worker or run one worker per machine).
+    """
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {value}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+stage_seconds = registry.register(Histogram(
+    "storybooker_stage_seconds", "Duration of pipeline stages", ("stage", "provider", "outcome")))
+stage_in_flight = registry.register(Gauge(
+    "storybooker_stage_in_flight", "Pipeline stages currently running", ("stage",)))
+stage_bytes = registry.register(Counter(
+    "storybooker_stage_bytes_total", "Bytes sent to and received from pipeline stages", ("stage", "direction")))
+job_queue_seconds = registry.register(Histogram(
+    "storybooker_job_queue_seconds", "Time from queueing a job (on submit, retry or page regeneration) until a worker starts it"))
+job_peak_bytes = registry.register(Histogram(
+    "storybooker_job_peak_bytes", "Peak accounted memory of a job (or batch)", buckets=BYTE_BUCKETS))
+memory_admitted_bytes = registry.register(Gauge(
+    "storybooker_memory_admitted_bytes", "Memory reserved by the running jobs on this machine, as of the last admission"))
+admission_deferred = registry.register(Counter(
+    "storybooker_admission_deferred_total", "Times a queued job was left waiting because the memory budget was full"))
+quota_refund_failures = registry.register(Counter(
+    "storybooker_quota_refund_failures_total", "Generations that could not be given back after a failed or abandoned job"))
+process_rss_bytes = registry.register(Gauge(
+    "storybooker_process_rss_bytes", "Resident set size of this process at scrape time"))
+
+
+class Stage:
+    """
+    Handle for a running stage, to record payload sizes and extra span attributes.
+    """
+
+    def __init__(self, name: str, span):
+        self.name = name
+        self.span = span
+
+    def record(self, bytes_in: int = None, bytes_out: int = None, **attributes):
+        if bytes_in is not None:
+            stage_bytes.inc(self.name, "in", amount=bytes_in)
+            self.span.set_attribute("bytes_in", bytes_in)
+        if bytes_out is not None:
+            stage_bytes.inc(self.name, "out", amount=bytes_out)
+            self.span.set_attribute("bytes_out", bytes_out)
+        for key, value in attributes.items():
+            self.span.set_attribute(key, value)
+
+
+@contextmanager
+def stage(name: str, provider: str = "local", **attributes):
+    """
+    Purpose: Traces and times one pipeline stage (a tool call, PDF compile, upload, ...)
+    Input: name is the stage name used as span name and metric label, eg. "scene"
+           provider is the remote service the stage calls, "local" for in-process work
+           attributes are added to the span, eg. page=3
+    Output: context manager yielding a Stage; the duration lands in storybooker_stage_seconds
+            with outcome "ok" or "error", and the stage counts as in flight while it runs
+    """
+    start = time.perf_counter()
+    stage_in_flight.inc(name)
+    outcome = "error"
+    try:
+        with tracer.start_as_current_span(name, attributes={"provider": provider, **attributes}) as span:
+            yield Stage(name, span)
+            outcome = "ok"
+    finally:
+        stage_in_flight.dec(name)
+        stage_seconds.observe(time.perf_counter() - start, name, provider, outcome)
+
+
+def bind(fn):
+    """
+    Wraps fn so it runs in the caller's trace context, eg. when handed to a thread pool.
+    Other context variables of the caller (eg. the memory meter of the job) are passed along as well.
+    """
+    parent = context.get_current()
+    variables = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        def attached():
+            token = context.attach(parent)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                context.detach(token)
+        # a copy per call, a context cannot be entered by two threads at once
+        return variables.copy().run(attached)
+    return run
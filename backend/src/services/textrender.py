@@ -0,0 +1,124 @@
+import os
+from functools import lru_cache
+
+import cv2
+import numpy as np
+
+FONT = cv2.FONT_HERSHEY_COMPLEX
+FONT_SCALE = 1
+FONT_THICKNESS = 2
+OUTLINE_THICKNESS = 6
+LINE_SPACING = 10
+MARGIN = 24
+
+FONT_COLOR = (255, 255, 255)  # BGR
+OUTLINE_COLOR = (0, 0, 0)
+
+OUTLINE_KERNEL = cv2.getStructuringElement(
+    cv2.MORPH_ELLIPSE, (OUTLINE_THICKNESS - FONT_THICKNESS + 1, OUTLINE_THICKNESS - FONT_THICKNESS + 1))
+
+CACHE_SIZE = int(os.environ.get("TEXT_CACHE_SIZE", "32"))
+
+
+def text_width(text: str) -> int:
+    return cv2.getTextSize(text, FONT, FONT_SCALE, FONT_THICKNESS)[0][0]
+
+
+def wrap(text: str, max_width: int) -> list:
+    """
+    Purpose: Greedily wraps text so that every line fits in max_width pixels when drawn with FONT
+    Input: text is the narration; max_width is the available width in pixels
+    Output: list of lines; a single word wider than max_width gets a line of its own
+    """
+    lines = []
+    line = ""
+    for word in text.split():
+        candidate = f"{line} {word}" if line else word
+        if line and text_width(candidate) > max_width:
+            lines.append(line)
+            line = word
+        else:
+            line = candidate
+    if line:
+        lines.append(line)
+    return lines
+
+
+class TextLayer:
+    """
+    Pre-rendered narration block, ready to be blended onto a page with
+    page = (page * keep + add) / 255 over the rows/columns it covers.
+    `keep` is how much of the page shows through (0-255) and `add` is the premultiplied outline and fill colour.
+    """
+
+    def __init__(self, keep: np.ndarray, add: np.ndarray, bottom_offset: int, left: int):
+        self.keep = keep
+        self.add = add
+        self.bottom_offset = bottom_offset  # rows between the top of the block and the bottom of the page
+        self.left = left
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def render(text: str, image_width: int) -> TextLayer:
+    """
+    Purpose: Lays out and rasterizes narration once into an alpha layer; cached per (text, image width)
+    Input: text is the narration; image_width is the width of the page it will be drawn on
+    Output: TextLayer with the outline and fill already combined
+    """
+    lines = wrap(text, image_width - 2 * MARGIN)
+    (_, text_height), baseline = cv2.getTextSize("Ag", FONT, FONT_SCALE, FONT_THICKNESS)
+    gap = text_height + LINE_SPACING
+    pad = OUTLINE_THICKNESS
+
+    # lines are stacked `gap` apart like the original per-line cv2.putText loop; the block only spans
+    # the columns the widest line (plus its outline) covers, so nothing is drawn or blended outside it
+    widths = [text_width(line) for line in lines]
+    starts = [(image_width - width) // 2 for width in widths]
+    left = max(min(starts, default=0) - pad, 0)
+    right = min(max((start + width for start, width in zip(starts, widths)), default=0) + pad, image_width)
+    block_height = len(lines) * gap + baseline + 2 * pad
+    fill = np.zeros((block_height, max(right - left, 0)), dtype=np.uint8)
+    for i, line in enumerate(lines):
+        y = text_height + pad + i * gap
+        cv2.putText(fill, line, (starts[i] - left, y), FONT, FONT_SCALE, 255, FONT_THICKNESS, lineType=cv2.LINE_AA)
+    # the outline is the fill grown by the difference in stroke width: a thick anti-aliased putText per line
+    # costs several times as much and looks the same
+    outline = cv2.dilate(fill, OUTLINE_KERNEL) if fill.size else fill
+
+    # page * (1 - a_outline) * (1 - a_fill) + outline_color * a_outline * (1 - a_fill) + font_color * a_fill, in 0-255 fixed point;
+    # keep + a_outline * (1 - a_fill) + a_fill stays within 255, so the blend fits in uint16
+    show = 255 - fill
+    keep = cv2.multiply(255 - outline, show, scale=1 / 255)
+    outline_only = cv2.multiply(outline, show, scale=1 / 255).astype(np.uint16)
+    add = np.empty(fill.shape + (3,), dtype=np.uint16)
+    for channel in range(3):
+        add[:, :, channel] = outline_only * OUTLINE_COLOR[channel] + fill.astype(np.uint16) * FONT_COLOR[channel]
+
+    # first baseline is at page_height - gap - len(lines) * gap and sits text_height + pad below the top of the block
+    bottom_offset = gap + len(lines) * gap + text_height + pad
+    return TextLayer(keep[:, :, None], add, bottom_offset, left)
+
+
+def overlay_text(image: np.ndarray, text: str) -> np.ndarray:
+    """
+    Purpose: Draws outlined narration centred at the bottom of a page in a single blend
+    Input: image is a BGR uint8 page array, modified in place; text is the narration
+    Output: the same array
+    """
+    img_height, img_width = image.shape[:2]
+    layer = render(text, img_width)
+    top = img_height - layer.bottom_offset
+    rows, cols = layer.keep.shape[:2]
+
+    # clip the block to the page
+    skip = max(0, -top)
+    top = max(0, top)
+    rows = min(rows - skip, img_height - top)
+    if rows <= 0 or cols == 0:
+        return image
+
+    region = image[top:top + rows, layer.left:layer.left + cols]
+    keep = layer.keep[skip:skip + rows]
+    add = layer.add[skip:skip + rows]
+    region[...] = (region.astype(np.uint16) * keep + add + 127) // 255
+    return image
@@ -0,0 +1,91 @@
+import base64
+import time
+
+import jwt
+import pytest
+
+from src.services.auth import TokenVerifier
+
+SECRET = "s" * 32
+JWK_SECRET = b"k" * 48
+
+
+class Remote:
+    def __init__(self, user=None):
+        self.user = user
+        self.calls = 0
+
+    def __call__(self, token):
+        self.calls += 1
+        return self
+
+
+class Jwks:
+    # stands in for PyJWKClient: every token maps to one key, published with its own algorithm
+    def __init__(self, algorithm: str):
+        self.key = jwt.PyJWK({"kty": "oct", "k": base64.urlsafe_b64encode(JWK_SECRET).decode().rstrip("="), "alg": algorithm})
+
+    def get_signing_key_from_jwt(self, token):
+        return self.key
+
+
+def claims(**overrides):
+    return dict({"sub": "user-1", "email": "a@b.c", "aud": "authenticated", "exp": time.time() + 60}, **overrides)
+
+
+@pytest.fixture
+def remote():
+    return Remote()
+
+
+@pytest.fixture
+def verifier(remote):
+    return TokenVerifier(remote, jwt_secret=SECRET)
+
+
+def test_secret_token(verifier, remote):
+    user = verifier.verify(jwt.encode(claims(), SECRET, algorithm="HS256"))
+    assert (user.id, user.email) == ("user-1", "a@b.c")
+    assert remote.calls == 0
+
+
+def test_wrong_secret(verifier):
+    assert verifier.verify(jwt.encode(claims(), "x" * 32, algorithm="HS256")) is None
+
+
+def test_expired_token(verifier):
+    assert verifier.verify(jwt.encode(claims(exp=time.time() - 10), SECRET, algorithm="HS256")) is None
+
+
+def test_wrong_audience(verifier):
+    assert verifier.verify(jwt.encode(claims(aud="anon"), SECRET, algorithm="HS256")) is None
+
+
+def test_secret_path_only_accepts_hs256(verifier, remote):
+    # a token signed with the secret under another HMAC algorithm is not accepted locally
+    token = jwt.encode(claims(), SECRET, algorithm="HS512")
+    assert verifier.verify(token) is None
+    assert remote.calls == 1
+
+
+def test_unsigned_token(verifier):
+    assert verifier.verify(jwt.encode(claims(), None, algorithm="none")) is None
+
+
+def test_jwks_token_uses_the_key_algorithm(verifier, remote):
+    verifier.jwks = Jwks("HS384")
+    assert verifier.verify(jwt.encode(claims(), JWK_SECRET, algorithm="HS384")).id == "user-1"
+    assert remote.calls == 0
+
+
+def test_jwks_token_header_cannot_choose_the_algorithm(verifier, remote):
+    verifier.jwks = Jwks("HS384")
+    assert verifier.verify(jwt.encode(claims(), JWK_SECRET, algorithm="HS512")) is None
+    assert remote.calls == 1
+
+
+def test_verified_tokens_are_cached(verifier):
+    token = jwt.encode(claims(), SECRET, algorithm="HS256")
+    verifier.verify(token)
+    verifier.verify(token)
+    assert verifier.stats()["hits"] == 1
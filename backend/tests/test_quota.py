@@ -0,0 +1,144 @@
+import threading
+
+import pytest
+
+from src.services import quota, telemetry
+from src.services.fakesupabase import FakeSupabase
+from src.services.quota import LocalQuota, QuotaExceeded, ProfileNotFound, RefundFailed, Reservation, SupabaseQuota
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(quota, "REFUND_BACKOFF", 0)
+
+
+def supabase_with(**balances):
+    supabase = FakeSupabase()
+    for user_id, remaining in balances.items():
+        supabase.table("profiles").insert({"user_id": user_id, "remaining_gens": remaining}).execute()
+    return supabase
+
+
+def remaining(supabase, user_id):
+    return supabase.table("profiles").select("remaining_gens").eq("user_id", user_id).maybe_single().execute().data["remaining_gens"]
+
+
+class ConflictingQuota(SupabaseQuota):
+    # another request changes remaining_gens between the read and the write, `conflicts` times
+    def __init__(self, supabase, conflicts: int, **kwargs):
+        super().__init__(supabase, **kwargs)
+        self.conflicts = conflicts
+
+    def _compare_and_set(self, user_id, seen, value):
+        if self.conflicts:
+            self.conflicts -= 1
+            return False
+        return super()._compare_and_set(user_id, seen, value)
+
+
+def test_reserve_takes_one_generation():
+    supabase = supabase_with(alice=2)
+    SupabaseQuota(supabase).reserve("alice")
+    assert remaining(supabase, "alice") == 1
+
+
+def test_reserve_without_generations_left():
+    supabase = supabase_with(alice=0)
+    with pytest.raises(QuotaExceeded):
+        SupabaseQuota(supabase).reserve("alice")
+    assert remaining(supabase, "alice") == 0
+
+
+def test_reserve_without_profile():
+    with pytest.raises(ProfileNotFound):
+        SupabaseQuota(supabase_with()).reserve("alice")
+
+
+def test_reserve_retries_on_conflict():
+    supabase = supabase_with(alice=3)
+    ConflictingQuota(supabase, conflicts=2, max_attempts=3).reserve("alice")
+    assert remaining(supabase, "alice") == 2
+
+
+def test_reserve_gives_up_after_max_attempts():
+    supabase = supabase_with(alice=3)
+    with pytest.raises(RuntimeError):
+        ConflictingQuota(supabase, conflicts=3, max_attempts=3).reserve("alice")
+    assert remaining(supabase, "alice") == 3
+
+
+def test_concurrent_reservations_never_overspend():
+    supabase = supabase_with(alice=5)
+    supabase_quota = SupabaseQuota(supabase, max_attempts=100)
+    reserved, refused = [], []
+
+    def reserve():
+        try:
+            reserved.append(supabase_quota.reserve("alice"))
+        except QuotaExceeded:
+            refused.append(True)
+
+    threads = [threading.Thread(target=reserve) for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert (len(reserved), len(refused)) == (5, 15)
+    assert remaining(supabase, "alice") == 0
+
+
+def test_refund_retries_on_conflict():
+    supabase = supabase_with(alice=1)
+    ConflictingQuota(supabase, conflicts=4, max_attempts=1, refund_attempts=5).refund("alice")
+    assert remaining(supabase, "alice") == 2
+
+
+def test_refund_raises_when_it_cannot_be_made():
+    supabase = supabase_with(alice=1)
+    with pytest.raises(RefundFailed):
+        ConflictingQuota(supabase, conflicts=5, refund_attempts=5).refund("alice")
+    assert remaining(supabase, "alice") == 1
+
+
+def test_reservation_refund_reports_a_failed_refund():
+    supabase = supabase_with(alice=1)
+    failures = telemetry.quota_refund_failures.samples()
+    Reservation(ConflictingQuota(supabase, conflicts=5, refund_attempts=5), "alice").refund()
+    assert telemetry.quota_refund_failures.samples() != failures
+    assert remaining(supabase, "alice") == 1
+
+
+def test_local_quota():
+    local = LocalQuota({"alice": 1}, default=2)
+    local.reserve("alice")
+    with pytest.raises(QuotaExceeded):
+        local.reserve("alice")
+    local.refund("alice")
+    assert local.balances["alice"] == 1
+    local.reserve("bob")
+    assert local.balances["bob"] == 1
+
+
+def test_reservation_settles_once():
+    local = LocalQuota({"alice": 1})
+    reservation = local.reserve("alice")
+    reservation.refund()
+    reservation.refund()
+    reservation.commit()
+    assert local.balances["alice"] == 1
+
+    reservation = local.reserve("alice")
+    reservation.commit()
+    reservation.refund()
+    assert local.balances["alice"] == 0
+
+
+def test_concurrent_refunds_of_one_reservation():
+    local = LocalQuota({"alice": 1})
+    reservation = local.reserve("alice")
+    threads = [threading.Thread(target=reservation.refund) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert local.balances["alice"] == 1
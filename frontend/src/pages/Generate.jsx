@@ -1,22 +1,72 @@
 import { useState } from "react";
 import { Typography, Paper, Button, Stack, TextField } from "@mui/material";
 
+const API_URL = import.meta.env.PROD ? import.meta.env.VITE_PROD_API_URL : import.meta.env.VITE_DEV_API_URL;
+
+// resolves once the job is done, calling onPage with each page preview as it is generated
+const waitForJob = (jobId, onPage) =>
+  new Promise((resolve, reject) => {
+    const events = new EventSource(
+      `${API_URL}/jobs/${jobId}/events?access_token=${localStorage.getItem("token")}`
+    );
+    events.addEventListener("page", (e) => {
+      const data = JSON.parse(e.data);
+      onPage(data.page, data.preview);
+    });
+    events.addEventListener("done", () => {
+      events.close();
+      resolve();
+    });
+    events.addEventListener("failed", () => {
+      events.close();
+      reject(new Error("Storybook generation failed"));
+    });
+    // fired when the server ends the stream (it reconnects by itself), drops it, or refuses it (401/404)
+    events.onerror = async () => {
+      try {
+        const res = await fetch(`${API_URL}/jobs/${jobId}`, {
+          headers: { Authorization: `Bearer ${localStorage.getItem("token")}` },
+        });
+        const job = await res.json();
+        if (!res.ok) {
+          throw new Error(job.error || "Could not follow storybook generation");
+        }
+        if (job.status === "done") {
+          events.close();
+          resolve();
+        } else if (job.status === "failed") {
+          throw new Error(job.error || "Storybook generation failed");
+        } else if (events.readyState === EventSource.CLOSED) {
+          throw new Error("Lost connection to the server");
+        }
+      } catch (err) {
+        events.close();
+        reject(err);
+      }
+    };
+  });
+
 export default function Generate() {
   const [title, setTitle] = useState("");
   const [prompt, setPrompt] = useState("");
   const [error, setError] = useState("");
   const [pdf, setPdf] = useState("");
+  const [previews, setPreviews] = useState({});
   const [loading, setLoading] = useState(false);
 
   const handleGenerate = async (e) => {
     e.preventDefault();
     setError("");
     setLoading(true);
+    if (pdf) {
+      URL.revokeObjectURL(pdf);
+    }
     setPdf("");
+    setPreviews({});
 
     try {
       const res = await fetch(
-        `${import.meta.env.PROD ? import.meta.env.VITE_PROD_API_URL : import.meta.env.VITE_DEV_API_URL}/generate`,
+        `${API_URL}/generate`,
         {
           method: "POST",
           headers: {
@@ -34,7 +84,18 @@ export default function Generate() {
         throw new Error("Generation request failed");
       }
 
-      setPdf(data.pdf_data);
+      // generation runs as a background job; show pages as they arrive
+      await waitForJob(data.job_id, (page, preview) =>
+        setPreviews((current) => ({ ...current, [page]: preview }))
+      );
+
+      const headers = { Authorization: `Bearer ${localStorage.getItem("token")}` };
+      const resultRes = await fetch(`${API_URL}/jobs/${data.job_id}/result`, { headers });
+      if (!resultRes.ok) {
+        const result = await resultRes.json();
+        throw new Error(result.error || "Generation request failed");
+      }
+      setPdf(URL.createObjectURL(await resultRes.blob()));
     } catch (err) {
       setError(err.message);
       console.log(err.message);
@@ -98,9 +159,22 @@ export default function Generate() {
             </Typography>
           )}
         </Stack>
+        {!pdf && Object.keys(previews).length > 0 && (
+          <Stack direction="row" flexWrap="wrap" gap={2} mt={3}>
+            {Object.entries(previews).map(([page, preview]) => (
+              <img
+                key={page}
+                src={`data:image/jpeg;base64,${preview}`}
+                alt={`Page ${page}`}
+                width={192}
+                style={{ borderRadius: "8px", boxShadow: "0 2px 8px rgba(0, 0, 0, 0.1)" }}
+              />
+            ))}
+          </Stack>
+        )}
         {pdf && (
           <embed
-            src={`data:application/pdf;base64,${pdf}`}
+            src={pdf}
             type="application/pdf"
             width="100%"
             height="600px"
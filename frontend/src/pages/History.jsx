@@ -20,31 +20,33 @@ export default function HistoryPage() {
     return `${import.meta.env.PROD ? import.meta.env.VITE_PROD_API_URL : import.meta.env.VITE_DEV_API_URL}/book/download?access_token=${localStorage.getItem("token")}&storybook_id=${item.id}`;
   };
 
-  useEffect(() => {
-    const fetchHistory = async () => {
-      try {
-        const res = await fetch(
-          `${import.meta.env.PROD ? import.meta.env.VITE_PROD_API_URL : import.meta.env.VITE_DEV_API_URL}/get-history`,
-          {
-            method: "GET",
-            headers: {
-              "Content-Type": "image/png",
-              "Content-Disposition": "attachment",
-              Authorization: `Bearer ${localStorage.getItem("token")}`,
-            },
-          }
-        );
+  const [nextCursor, setNextCursor] = useState(null);
+
+  const fetchHistory = async (cursor) => {
+    try {
+      const res = await fetch(
+        `${import.meta.env.PROD ? import.meta.env.VITE_PROD_API_URL : import.meta.env.VITE_DEV_API_URL}/get-history${cursor ? `?cursor=${cursor}` : ""}`,
+        {
+          method: "GET",
+          headers: {
+            Authorization: `Bearer ${localStorage.getItem("token")}`,
+          },
+        }
+      );
+
+      if (!res.ok) throw new Error("Failed to fetch history");
 
-        if (!res.ok) throw new Error("Failed to fetch history");
+      const data = await res.json();
+      setHistoryItems((items) => (cursor ? [...items, ...data.history] : data.history));
+      setNextCursor(data.next_cursor);
+    } catch (err) {
+      setError("Could not load history");
+      console.log(err.message);
+    }
+  };
 
-        const data = await res.json();
-        setHistoryItems(data.history);
-      } catch (err) {
-        setError("Could not load history");
-        console.log(err.message);
-      }
-    };
-    fetchHistory();
+  useEffect(() => {
+    fetchHistory(null);
   }, []);
 
   return (
@@ -104,6 +106,15 @@ export default function HistoryPage() {
           </ListItem>
         ))}
       </List>
+      {nextCursor && (
+        <Button
+          onClick={() => fetchHistory(nextCursor)}
+          variant="outlined"
+          sx={{ textTransform: "none", borderRadius: 2 }}
+        >
+          Load more
+        </Button>
+      )}
       {error && (
         <Typography color="error" fontSize="0.9rem">
           {error}